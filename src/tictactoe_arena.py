@@ -0,0 +1,386 @@
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+
+from tictactoe_minimax import (BOARD_SIZE, CENTRE_CORNERS_EDGES_ORDERING, DEFAULT_MCTS_ITERATIONS,
+                               DEFAULT_TIME_BUDGET_IN_SECONDS, GAME_TOKEN, LATENCY_PERCENTILES, MOVE,
+                               OPENING_BOOK_PATH, TIC_TAC_TOE_TOKENS, WINNING_LINE_LENGTH, AIPlayer,
+                               MonteCarloTreeSearchBrain, RandomPlayer, TicTacToeBoard, TicTacToeBrain, TicTacToeGame,
+                               TicTacToeGameUtil, TicTacToeOpeningBook, default_time_budget, summarize_latencies)
+
+# The kinds of players the arena knows how to build, they are passed around by name so they can go to other processes
+MINIMAX_PLAYER = "minimax"
+ALPHA_BETA_PLAYER = "alphabeta"
+BOOK_PLAYER = "book"
+RANDOM_PLAYER = "random"
+MCTS_PLAYER = "mcts"
+ARENA_PLAYERS = (MINIMAX_PLAYER, ALPHA_BETA_PLAYER, BOOK_PLAYER, RANDOM_PLAYER, MCTS_PLAYER)
+
+# How many times the random opening moves are tried again after they finished the game
+MAX_OPENING_ATTEMPTS = 1000
+
+# Brains only keep state for the move being calculated, so every game played by a worker process can share them. The
+#  MCTS ones are the exception, see build_player
+_brains = {}
+
+
+class TimedPlayer:
+    """
+    Wraps a player to measure how long each of its moves takes, the game sees it as the player itself
+    """
+
+    def __init__(self, player):
+        self.player = player
+        self.name = player.name
+        self.ui = player.ui
+        self.game_token = player.game_token
+        self.move_latencies_ns = []
+
+    def make_move(self, board) -> dict:
+        start_time = time.perf_counter_ns()
+        move = self.player.make_move(board)
+        self.move_latencies_ns.append(time.perf_counter_ns() - start_time)
+
+        return move
+
+    def __str__(self):
+        return str(self.player)
+
+
+def get_brain(player_kind: str, time_budget: float) -> TicTacToeBrain:
+    key = (player_kind, time_budget)
+
+    if key not in _brains:
+        if player_kind == MINIMAX_PLAYER:
+            _brains[key] = TicTacToeBrain(time_budget=time_budget)
+        elif player_kind == ALPHA_BETA_PLAYER:
+            _brains[key] = TicTacToeBrain(use_alpha_beta=True, move_ordering=CENTRE_CORNERS_EDGES_ORDERING,
+                                          time_budget=time_budget)
+        else:
+            # Without a book to answer from it still has to play well and fast, so it searches like alphabeta
+            _brains[key] = TicTacToeBrain(use_alpha_beta=True, move_ordering=CENTRE_CORNERS_EDGES_ORDERING,
+                                          opening_book_path=OPENING_BOOK_PATH, time_budget=time_budget)
+
+    return _brains[key]
+
+
+def build_player(player_kind: str, game_token, seed: int, time_budget: float,
+                 mcts_iterations: int = DEFAULT_MCTS_ITERATIONS):
+    if player_kind not in ARENA_PLAYERS:
+        raise ValueError(f"Unknown player: {player_kind}, use one of {', '.join(ARENA_PLAYERS)}")
+
+    if player_kind == RANDOM_PLAYER:
+        return RandomPlayer(game_token, seed)
+
+    if player_kind == MCTS_PLAYER:
+        # Its rollouts are random, so every player gets its own brain seeded from the game for repeatable runs. It
+        #  searches on this process only, the arena already plays the games on many of them
+        return AIPlayer(MonteCarloTreeSearchBrain(iterations=mcts_iterations, time_budget=time_budget, seed=seed),
+                        game_token)
+
+    return AIPlayer(get_brain(player_kind, time_budget), game_token)
+
+
+def play_arena_game(game_settings: dict) -> dict:
+    """
+    Plays a single game without any output, this is what runs on the worker processes
+    :param game_settings: a dict with the players for X and O, the board dimensions, how many random opening moves
+    to make, the time budget and MCTS iterations for the brains and the seed for this game
+    :return: a dict with the str of the winning token (None for a draw), the number of moves and the move latencies
+    of each token
+    """
+    rng = random.Random(game_settings["seed"])
+    x_token, o_token = TIC_TAC_TOE_TOKENS
+
+    players = [
+        TimedPlayer(build_player(game_settings["x"], x_token, rng.randrange(2 ** 32), game_settings["time_budget"],
+                                 game_settings["mcts_iterations"])),
+        TimedPlayer(build_player(game_settings["o"], o_token, rng.randrange(2 ** 32), game_settings["time_budget"],
+                                 game_settings["mcts_iterations"]))
+    ]
+    game = TicTacToeGame(players, game_settings["rows"], game_settings["columns"], game_settings["k"])
+
+    # Play the opening moves at random, making sure they don't finish the game
+    opening_moves = 0
+    attempts = 1
+
+    while opening_moves < game_settings["opening_moves"]:
+        move = rng.choice(game.board.get_empty_spaces_coordinates())
+        game.apply_move({GAME_TOKEN: TIC_TAC_TOE_TOKENS[opening_moves % 2], MOVE: move})
+        opening_moves += 1
+
+        if game.is_game_over():
+            if attempts == MAX_OPENING_ATTEMPTS:
+                raise ValueError(f"Couldn't find {game_settings['opening_moves']} opening moves that don't finish "
+                                 f"the game in {MAX_OPENING_ATTEMPTS} attempts")
+
+            game.board.init_board()
+            game.load_board_state()
+            game.winner = None
+            opening_moves = 0
+            attempts += 1
+
+    # The game always starts with the first player of the list
+    if opening_moves % 2:
+        game.players.reverse()
+
+    game.play()
+
+    return {
+        "winner": str(game.winner.game_token) if game.winner else None,
+        "moves": bin(game.board.x_bits | game.board.o_bits).count("1"),
+        "latencies_ns": {str(p.game_token): p.move_latencies_ns for p in players}
+    }
+
+
+def run_arena(player_a: str,
+              player_b: str,
+              games: int,
+              workers: int = None,
+              rows: int = BOARD_SIZE,
+              columns: int = BOARD_SIZE,
+              k: int = WINNING_LINE_LENGTH,
+              opening_moves: int = 0,
+              time_budget: float = None,
+              seed: int = 0,
+              mcts_iterations: int = DEFAULT_MCTS_ITERATIONS) -> dict:
+    """
+    Plays games between player_a and player_b, switching who plays X (and therefore starts) on every game
+    :param workers: how many processes to play on, 0 plays every game on this process
+    :param opening_moves: how many moves to make at random before the players take over
+    :return: a dict with the results, move latencies and speed of the run
+    """
+    if opening_moves >= rows * columns:
+        raise ValueError(f"There is no room for {opening_moves} opening moves on a {rows}x{columns} board")
+
+    if opening_moves and k == 1:
+        raise ValueError("Every move wins a game with 1 in a row, there can't be any opening moves")
+
+    time_budget = default_time_budget(rows, columns, k, time_budget)
+
+    all_settings = []
+
+    for game_number in range(games):
+        x_player, o_player = (player_a, player_b) if game_number % 2 == 0 else (player_b, player_a)
+        all_settings.append({
+            "x": x_player,
+            "o": o_player,
+            "a_token": "X" if game_number % 2 == 0 else "O",
+            "rows": rows,
+            "columns": columns,
+            "k": k,
+            "opening_moves": opening_moves,
+            "time_budget": time_budget,
+            "mcts_iterations": mcts_iterations,
+            "seed": seed * games + game_number
+        })
+
+    start_time = time.perf_counter()
+
+    if workers == 0:
+        results = [play_arena_game(s) for s in all_settings]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(play_arena_game, all_settings, chunksize=max(1, games // 64)))
+
+    elapsed_time = time.perf_counter() - start_time
+
+    a_wins = b_wins = draws = total_moves = 0
+    a_latencies = []
+    b_latencies = []
+
+    for settings, result in zip(all_settings, results):
+        b_token = "O" if settings["a_token"] == "X" else "X"
+
+        if result["winner"] is None:
+            draws += 1
+        elif result["winner"] == settings["a_token"]:
+            a_wins += 1
+        else:
+            b_wins += 1
+
+        total_moves += result["moves"]
+        a_latencies.extend(result["latencies_ns"][settings["a_token"]])
+        b_latencies.extend(result["latencies_ns"][b_token])
+
+    return {
+        "board": {"rows": rows, "columns": columns, "k": k},
+        "opening_moves": opening_moves,
+        "games": games,
+        "elapsed_seconds": elapsed_time,
+        "games_per_second": games / elapsed_time if elapsed_time else None,
+        "moves_per_game": total_moves / games if games else None,
+        "player_a": {"kind": player_a, "wins": a_wins, "draws": draws, "losses": b_wins,
+                     "latency": summarize_latencies(a_latencies)},
+        "player_b": {"kind": player_b, "wins": b_wins, "draws": draws, "losses": a_wins,
+                     "latency": summarize_latencies(b_latencies)}
+    }
+
+
+def get_positions_to_judge() -> list:
+    """
+    Every position of a 3x3 game that hasn't finished yet, as the bits of the player to move and of the other one
+    """
+    positions = set()
+    x_token, o_token = TIC_TAC_TOE_TOKENS
+    board = TicTacToeBoard()
+
+    def visit(to_move, waiting):
+        if TicTacToeGameUtil.get_winner(board) or board.is_full():
+            return
+
+        positions.add((board.get_token_bits(to_move), board.get_token_bits(waiting)))
+
+        for cell in board.get_empty_cells():
+            board.make_move(cell, to_move)
+            visit(waiting, to_move)
+            board.unmake_move(cell, to_move)
+
+    # Either player can start, which only swaps which tokens the bits belong to
+    visit(x_token, o_token)
+
+    return sorted(positions)
+
+
+def measure_move_quality(player_kind: str, positions: int, time_budget: float = None,
+                         mcts_iterations: int = DEFAULT_MCTS_ITERATIONS, seed: int = 0) -> dict:
+    """
+    Checks the moves of player_kind against the solved 3x3 game, a move is optimal if it keeps the best value the
+    player to move can get
+    :param positions: how many of the unfinished positions to sample, None to judge all of them
+    :return: a dict with how many moves were optimal, their latencies and the rollouts/s for the MCTS brain
+    """
+    book = TicTacToeOpeningBook(TicTacToeOpeningBook.solve())
+    all_positions = get_positions_to_judge()
+
+    if positions is not None and positions < len(all_positions):
+        all_positions = random.Random(seed).sample(all_positions, positions)
+
+    x_token = TIC_TAC_TOE_TOKENS[0]
+    player = TimedPlayer(build_player(player_kind, x_token, seed, time_budget, mcts_iterations))
+    brain = getattr(player.player, "brain", None)
+    optimal_moves = 0
+    rollouts_per_second = []
+
+    for mover_bits, waiting_bits in all_positions:
+        board = TicTacToeBoard()
+        board.x_bits = mover_bits
+        board.o_bits = waiting_bits
+
+        cell = board.geometry.coordinates_to_cell(*player.make_move(board)[MOVE])
+        _, best_moves_mask = book.lookup(board, x_token)
+
+        if best_moves_mask >> cell & 1:
+            optimal_moves += 1
+
+        if isinstance(brain, MonteCarloTreeSearchBrain):
+            rollouts_per_second.append(brain.rollouts_per_second)
+
+    return {
+        "kind": player_kind,
+        "positions": len(all_positions),
+        "optimal_moves": optimal_moves,
+        "optimal_ratio": optimal_moves / len(all_positions),
+        "rollouts_per_second": sum(rollouts_per_second) / len(rollouts_per_second) if rollouts_per_second else None,
+        "latency": summarize_latencies(player.move_latencies_ns)
+    }
+
+
+def print_move_quality(report: dict):
+    latency = report["latency"]
+    print(f"{report['kind']}: {report['optimal_moves']}/{report['positions']} optimal moves "
+          f"({report['optimal_ratio'] * 100:.1f}%), mean {latency['mean_ms']:.3f} ms, "
+          f"p99 {latency['p99_ms']:.3f} ms per move")
+
+    if report["rollouts_per_second"] is not None:
+        print(f"  {report['rollouts_per_second']:,.0f} rollouts/s")
+
+
+def print_report(report: dict):
+    board = report["board"]
+    print(f"{report['games']} games on a {board['rows']}x{board['columns']} board with {board['k']} in a row, "
+          f"{report['opening_moves']} random opening moves")
+    print(f"Played in {report['elapsed_seconds']:.2f} s ({report['games_per_second']:.1f} games/s, "
+          f"{report['moves_per_game']:.1f} moves per game)")
+
+    for name in ("player_a", "player_b"):
+        player = report[name]
+        latency = player["latency"]
+        print(f"{name} ({player['kind']}): {player['wins']} wins, {player['draws']} draws, {player['losses']} losses")
+
+        if latency["moves"]:
+            percentiles = ", ".join(f"p{p} {latency[f'p{p}_ms']:.3f} ms" for p in LATENCY_PERCENTILES)
+            print(f"  {latency['moves']} moves, mean {latency['mean_ms']:.3f} ms, {percentiles}, "
+                  f"max {latency['max_ms']:.3f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Plays Tic Tac Toe AIs against each other without any UI")
+    parser.add_argument("--player-a", choices=ARENA_PLAYERS, default=BOOK_PLAYER)
+    parser.add_argument("--player-b", choices=ARENA_PLAYERS, default=RANDOM_PLAYER)
+    parser.add_argument("--games", type=int, default=1000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="processes to play the games on, 0 to play them all on this one")
+    parser.add_argument("--rows", type=int, default=BOARD_SIZE)
+    parser.add_argument("--columns", type=int, default=BOARD_SIZE)
+    parser.add_argument("-k", type=int, default=WINNING_LINE_LENGTH)
+    parser.add_argument("--opening-moves", type=int, default=0,
+                        help="moves to make at random before the players take over")
+    parser.add_argument("--time-budget", type=float, default=None,
+                        help="seconds per move for the AI players, they search until the end if not given on a 3x3 "
+                             f"board and take {DEFAULT_TIME_BUDGET_IN_SECONDS} s on any other")
+    parser.add_argument("--mcts-iterations", type=int, default=DEFAULT_MCTS_ITERATIONS,
+                        help="rollouts per move for the mcts players")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--move-quality", action="store_true",
+                        help="instead of playing games, check the moves of both players against the solved 3x3 game")
+    parser.add_argument("--positions", type=int, default=None,
+                        help="how many positions to sample for --move-quality, all of them if not given")
+    parser.add_argument("--json", metavar="PATH", help="also write the report as JSON to PATH")
+    parser.add_argument("--expect-player-a-unbeaten", action="store_true",
+                        help="exit with an error if player A loses any game, a perfect AI never does unless the "
+                             "random opening moves already lost the game for it")
+    args = parser.parse_args()
+
+    if BOOK_PLAYER in (args.player_a, args.player_b):
+        book = TicTacToeOpeningBook.load(OPENING_BOOK_PATH)
+
+        if book is None:
+            print(f"Couldn't load the opening book at {OPENING_BOOK_PATH}, the book player will search every move. "
+                  f"Build it with tictactoe_opening_book.py", file=sys.stderr)
+        else:
+            book.close()
+
+    if args.move_quality:
+        report = {name: measure_move_quality(kind, args.positions, args.time_budget, args.mcts_iterations, args.seed)
+                  for name, kind in (("player_a", args.player_a), ("player_b", args.player_b))}
+
+        for player_report in report.values():
+            print_move_quality(player_report)
+
+        if args.json:
+            with open(args.json, "w") as report_file:
+                json.dump(report, report_file, indent=2)
+
+        return
+
+    report = run_arena(args.player_a, args.player_b, args.games, args.workers, args.rows, args.columns, args.k,
+                       args.opening_moves, args.time_budget, args.seed, args.mcts_iterations)
+    print_report(report)
+
+    if args.json:
+        with open(args.json, "w") as report_file:
+            json.dump(report, report_file, indent=2)
+
+    if args.expect_player_a_unbeaten and report["player_a"]["losses"]:
+        print(f"player_a lost {report['player_a']['losses']} games!")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
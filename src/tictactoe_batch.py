@@ -0,0 +1,190 @@
+import argparse
+import time
+
+import numpy as np
+
+from tictactoe_minimax import (FULL_BOARD_MASK, LOSS_VALUE, NUMBER_OF_CELLS, NUMBER_OF_POSITIONS,
+                               OPENING_BOOK_PATH, RECORD_REACHABLE_FLAG, RECORD_VALUE_MASK, RECORD_VALUE_SHIFT,
+                               WIN_VALUE, WINNING_LINE_MASKS, TicTacToeOpeningBook)
+
+# Codes used for each cell once the boards are encoded, the same digits the opening book uses for its index
+EMPTY_CODE = 0
+X_CODE = 1
+O_CODE = 2
+
+# Marks a board that can't happen in a real game, like one where both players have a line
+NO_MOVE = -1
+
+CELL_BITS = np.left_shift(1, np.arange(NUMBER_OF_CELLS, dtype=np.int64))
+CELL_POWERS_OF_3 = 3 ** np.arange(NUMBER_OF_CELLS, dtype=np.int64)
+LINE_MASKS = np.array(WINNING_LINE_MASKS, dtype=np.int64)
+
+# The code for the first character of a serialized cell, a comma means it was empty. Like TicTacToeBoard.deserialize,
+#  tokens are case insensitive and any token that isn't an X is an O
+CODE_BY_CHARACTER = np.full(256, O_CODE, dtype=np.uint8)
+CODE_BY_CHARACTER[ord(",")] = EMPTY_CODE
+CODE_BY_CHARACTER[ord("X")] = X_CODE
+CODE_BY_CHARACTER[ord("x")] = X_CODE
+
+# The lowest cell set in every possible mask of best moves, which is the move minimax would choose
+LOWEST_CELL_BY_MASK = np.array([(m & -m).bit_length() - 1 if m else NO_MOVE for m in range(FULL_BOARD_MASK + 1)],
+                               dtype=np.int8)
+
+
+def encode_boards(serialized_boards) -> np.ndarray:
+    """
+    Turns boards in the TicTacToeBoard.serialize format into an array of cell codes
+    :param serialized_boards: an iterable of serialized 3x3 boards
+    :return: an (n, 9) uint8 array with EMPTY_CODE, X_CODE or O_CODE for every cell
+    """
+    serialized_boards = list(serialized_boards)
+
+    if not serialized_boards:
+        return np.zeros((0, NUMBER_OF_CELLS), dtype=np.uint8)
+
+    # With a comma in front of every board, each cell starts right after a comma and is either empty (followed by the
+    #  next comma) or a single token. A trailing comma lets us look past the last cell
+    text = "," + ",".join(serialized_boards) + ","
+    characters = np.frombuffer(text.encode(), dtype=np.uint8)
+
+    if characters.size != len(text):
+        # Anything that isn't ASCII becomes a single "?" so every character is still a single byte
+        characters = np.frombuffer(text.encode("ascii", errors="replace"), dtype=np.uint8)
+
+    all_commas = np.flatnonzero(characters == ord(","))
+    commas = all_commas[:-1]
+
+    # A board with too many cells next to one with too few would still add up, so every board is checked on its own
+    board_lengths = np.fromiter(map(len, serialized_boards), dtype=np.int64, count=len(serialized_boards))
+    board_ends = np.cumsum(board_lengths + 1)
+
+    if np.any(np.diff(np.searchsorted(all_commas, board_ends), prepend=0) != NUMBER_OF_CELLS):
+        raise ValueError(f"Every board must have exactly {NUMBER_OF_CELLS} comma-separated cells")
+
+    cell_characters = characters[commas + 1]
+    is_empty = cell_characters == ord(",")
+
+    # Every character that isn't a comma has to be the only one in its cell
+    if characters.size - commas.size - 1 != np.count_nonzero(~is_empty):
+        raise ValueError("Every cell must be empty or have a single token")
+
+    codes = CODE_BY_CHARACTER[cell_characters]
+
+    return codes.reshape(-1, NUMBER_OF_CELLS)
+
+
+def load_solved_positions(book_path: str = OPENING_BOOK_PATH) -> np.ndarray:
+    """
+    Gets the records of every position from the opening book, solving them in memory if the book can't be used
+    :return: an array with one uint16 record per position index
+    """
+    book = TicTacToeOpeningBook.load(book_path) if book_path else None
+
+    if book is None:
+        return np.frombuffer(TicTacToeOpeningBook.solve(), dtype="<u2")
+
+    # This is a view over the memory-mapped file, nothing is copied
+    return np.frombuffer(book.table, dtype="<u2", count=NUMBER_OF_POSITIONS, offset=book.table_offset)
+
+
+class BatchEvaluator:
+
+    def __init__(self, book_path: str = OPENING_BOOK_PATH):
+        self.solved_positions = load_solved_positions(book_path)
+
+        # There are only 3^9 boards, so we solve all of them at once and evaluating a batch is just looking them up
+        all_codes = (np.arange(NUMBER_OF_POSITIONS, dtype=np.int64)[:, None] // CELL_POWERS_OF_3) % 3
+        self.results_by_index = self.solve_codes(all_codes)
+
+    def evaluate(self, boards) -> dict:
+        """
+        Solves many 3x3 boards at once. X is assumed to have started unless O has one more token than X
+        :param boards: an iterable of boards in the TicTacToeBoard.serialize format, or an (n, 9) array already
+        encoded like encode_boards does
+        :return: a dict of arrays with one entry per board:
+            to_move: X_CODE or O_CODE for the player to move
+            winner: X_CODE or O_CODE if someone already has a line, EMPTY_CODE if not
+            valid: False for boards that can't happen in a game, every other entry is meaningless for them
+            values: WIN_VALUE, DRAW_VALUE or LOSS_VALUE for the player to move
+            best_moves: the cell (x * 3 + y) minimax would choose, NO_MOVE once the game is over
+        """
+        codes = boards if isinstance(boards, np.ndarray) else encode_boards(boards)
+        indexes = codes.astype(np.int32, copy=False) @ CELL_POWERS_OF_3.astype(np.int32)
+
+        return {name: results[indexes] for name, results in self.results_by_index.items()}
+
+    def solve_codes(self, codes: np.ndarray) -> dict:
+        """
+        Does the actual work of evaluate for an (n, 9) array of cell codes, see evaluate for what it returns
+        """
+        codes = codes.astype(np.int64, copy=False)
+
+        is_x = codes == X_CODE
+        is_o = codes == O_CODE
+        x_bits = is_x @ CELL_BITS
+        o_bits = is_o @ CELL_BITS
+        x_count = is_x.sum(axis=1)
+        o_count = is_o.sum(axis=1)
+
+        x_has_line = ((x_bits[:, None] & LINE_MASKS) == LINE_MASKS).any(axis=1)
+        o_has_line = ((o_bits[:, None] & LINE_MASKS) == LINE_MASKS).any(axis=1)
+        winner = np.where(x_has_line, X_CODE, np.where(o_has_line, O_CODE, EMPTY_CODE)).astype(np.uint8)
+
+        # The book stores every position as if X had started, so swap the tokens of the games O started
+        o_started = o_count == x_count + 1
+        first_player_codes = np.where(o_started[:, None], (3 - codes) % 3, codes)
+        records = self.solved_positions[first_player_codes @ CELL_POWERS_OF_3].astype(np.int64)
+
+        to_move = np.where(x_count > o_count, O_CODE, X_CODE).astype(np.uint8)
+        valid = ((np.abs(x_count - o_count) <= 1) & ~(x_has_line & o_has_line) &
+                 ((records & RECORD_REACHABLE_FLAG) != 0))
+
+        values = ((records >> RECORD_VALUE_SHIFT) & RECORD_VALUE_MASK) - 1
+        best_moves = LOWEST_CELL_BY_MASK[records & FULL_BOARD_MASK]
+
+        # Finished games don't need the book at all
+        values = np.where(winner != EMPTY_CODE, np.where(winner == to_move, WIN_VALUE, LOSS_VALUE), values)
+        best_moves = np.where(winner != EMPTY_CODE, NO_MOVE, best_moves)
+
+        return {
+            "to_move": to_move,
+            "winner": winner,
+            "valid": valid,
+            "values": values.astype(np.int8),
+            "best_moves": best_moves.astype(np.int8)
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measures how many serialized boards per second can be evaluated")
+    parser.add_argument("--boards", type=int, default=1000000)
+    parser.add_argument("--book", default=OPENING_BOOK_PATH)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    start_time = time.perf_counter()
+    evaluator = BatchEvaluator(args.book)
+    print(f"Solved positions ready in {(time.perf_counter() - start_time) * 1000:.2f} ms")
+
+    # Sample boards from every position that can happen in a game
+    reachable_indexes = np.flatnonzero(evaluator.solved_positions & RECORD_REACHABLE_FLAG)
+    indexes = np.random.default_rng(args.seed).choice(reachable_indexes, size=args.boards)
+    codes = (indexes[:, None] // CELL_POWERS_OF_3) % 3
+    symbols = np.array(["", "X", "O"])[codes]
+    serialized_boards = [",".join(row) for row in symbols.tolist()]
+
+    start_time = time.perf_counter()
+    encoded_boards = encode_boards(serialized_boards)
+    encode_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    evaluator.evaluate(encoded_boards)
+    evaluate_time = time.perf_counter() - start_time
+
+    print(f"Encoded {args.boards} boards in {encode_time:.3f} s ({args.boards / encode_time:,.0f} boards/s)")
+    print(f"Evaluated {args.boards} boards in {evaluate_time:.3f} s ({args.boards / evaluate_time:,.0f} boards/s)")
+    print(f"Overall {args.boards / (encode_time + evaluate_time):,.0f} boards/s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,335 @@
+import argparse
+import json
+import platform
+import sys
+import time
+
+from tictactoe_minimax import (CENTRE_CORNERS_EDGES_ORDERING, LATENCY_PERCENTILES, TIC_TAC_TOE_TOKENS, AIPlayer,
+                               TicTacToeBoard, TicTacToeBrain, TicTacToeGame, TicTacToeGameUtil, summarize_latencies)
+
+# The position suites, every benchmark runs over each of them
+EMPTY_SUITE = "empty"
+ONE_PLY_SUITE = "one_ply"
+TWO_PLY_SUITE = "two_ply"
+MIDGAME_SUITE = "midgame"
+SUITES = (EMPTY_SUITE, ONE_PLY_SUITE, TWO_PLY_SUITE, MIDGAME_SUITE)
+
+# Fixed positions with 4 to 6 tokens where nobody has won yet, X always started so the token to move follows from
+#  the counts
+MIDGAME_POSITIONS = (
+    "X,,O,,X,,,,O",
+    "X,O,,,O,,,X,",
+    ",X,,O,X,,,O,",
+    "O,,X,,X,,,,O",
+    "X,O,X,,X,,,,O",
+    "X,,,O,X,X,,,O",
+    ",,X,X,O,,O,,X",
+    "X,O,X,,O,,O,X,"
+)
+
+MINIMAX_BENCHMARK = "minimax"
+ALPHA_BETA_BENCHMARK = "alpha_beta"
+GET_WINNER_BENCHMARK = "get_winner"
+SERIALIZE_BENCHMARK = "serialize"
+DESERIALIZE_BENCHMARK = "deserialize"
+GAME_BENCHMARK = "game"
+BENCHMARKS = (MINIMAX_BENCHMARK, ALPHA_BETA_BENCHMARK, GET_WINNER_BENCHMARK, SERIALIZE_BENCHMARK,
+              DESERIALIZE_BENCHMARK, GAME_BENCHMARK)
+
+# Brains the full games can be played with
+GAME_BRAINS = (MINIMAX_BENCHMARK, ALPHA_BETA_BENCHMARK)
+
+# The cheap calls take about as long as reading the clock, so they are timed in batches of this many calls
+DEFAULT_CALLS_PER_SAMPLE = 1000
+
+DEFAULT_REPEATS = 3
+
+# Untimed rounds over every suite before it is measured, so the first samples do not pay for filling caches such as
+#  the row strings of the board geometry
+DEFAULT_WARMUP_REPEATS = 1
+
+# How much slower than the baseline the p50 of a benchmark can get before it counts as a regression
+DEFAULT_MAX_SLOWDOWN = 0.25
+
+
+def get_position_suites() -> dict:
+    """
+    :return: a dict with a list of (board, token to move) tuples for each of SUITES
+    """
+    x_token, o_token = TIC_TAC_TOE_TOKENS
+    empty_board = TicTacToeBoard()
+    suites = {
+        EMPTY_SUITE: [(empty_board, x_token)],
+        ONE_PLY_SUITE: [],
+        TWO_PLY_SUITE: [],
+        MIDGAME_SUITE: []
+    }
+
+    for first_move in empty_board.get_empty_spaces_coordinates():
+        board = TicTacToeBoard()
+        board.place_token(*first_move, x_token)
+        suites[ONE_PLY_SUITE].append((board, o_token))
+
+        for second_move in board.get_empty_spaces_coordinates():
+            next_board = TicTacToeBoard().deserialize(board.serialize())
+            next_board.place_token(*second_move, o_token)
+            suites[TWO_PLY_SUITE].append((next_board, x_token))
+
+    for serialized_board in MIDGAME_POSITIONS:
+        board = TicTacToeBoard().deserialize(serialized_board)
+        to_move = x_token if bin(board.x_bits).count("1") == bin(board.o_bits).count("1") else o_token
+        suites[MIDGAME_SUITE].append((board, to_move))
+
+    return suites
+
+
+def build_brain(brain_kind: str) -> TicTacToeBrain:
+    # No opening book, we want to measure the search itself
+    if brain_kind == ALPHA_BETA_BENCHMARK:
+        return TicTacToeBrain(use_alpha_beta=True, move_ordering=CENTRE_CORNERS_EDGES_ORDERING)
+
+    return TicTacToeBrain()
+
+
+def benchmark_search(brain_kind: str, positions: list, repeats: int) -> dict:
+    """
+    Times the brain choosing a move for each of positions, using the search statistics it keeps for every call
+    """
+    brain = build_brain(brain_kind)
+    samples_ns = []
+    nodes_visited = 0
+
+    for _ in range(repeats):
+        for board, game_token in positions:
+            brain.calculate_next_move(board, game_token)
+            samples_ns.append(brain.statistics.elapsed_ns)
+            nodes_visited += brain.statistics.nodes_visited
+
+    elapsed_ns = sum(samples_ns)
+
+    return {
+        "calls": len(samples_ns),
+        "latency": summarize_latencies(samples_ns, "us", "samples"),
+        "nodes_visited": nodes_visited,
+        "nodes_per_second": nodes_visited / elapsed_ns * 1e9 if elapsed_ns else None,
+        "calls_per_second": len(samples_ns) / elapsed_ns * 1e9 if elapsed_ns else None
+    }
+
+
+def benchmark_calls(function, arguments: list, repeats: int, calls_per_sample: int) -> dict:
+    """
+    Times function over each of arguments, every sample is the average of calls_per_sample calls in a row
+    """
+    samples_ns = []
+
+    for _ in range(repeats):
+        for argument in arguments:
+            start_time = time.perf_counter_ns()
+
+            for _ in range(calls_per_sample):
+                function(argument)
+
+            samples_ns.append((time.perf_counter_ns() - start_time) / calls_per_sample)
+
+    calls = len(samples_ns) * calls_per_sample
+    elapsed_ns = sum(samples_ns) * calls_per_sample
+
+    return {
+        "calls": calls,
+        "latency": summarize_latencies(samples_ns, "us", "samples"),
+        "calls_per_second": calls / elapsed_ns * 1e9 if elapsed_ns else None
+    }
+
+
+def benchmark_games(brain_kind: str, positions: list, repeats: int) -> dict:
+    """
+    Plays a whole game between two AIPlayers from each of positions, they use the DummyUI so nothing is printed
+    """
+    brain = build_brain(brain_kind)
+    samples_ns = []
+    move_latencies_ns = []
+    moves = 0
+
+    for _ in range(repeats):
+        for board, game_token in positions:
+            other_token = [t for t in TIC_TAC_TOE_TOKENS if t is not game_token][0]
+            players = [AIPlayer(brain, game_token), AIPlayer(brain, other_token)]
+            game = TicTacToeGame(players)
+            game.board.deserialize(board.serialize())
+            game.load_board_state()
+
+            start_time = time.perf_counter_ns()
+            game.play()
+            samples_ns.append(time.perf_counter_ns() - start_time)
+
+            for player in players:
+                moves += len(player.statistics_history)
+                move_latencies_ns.extend(s.elapsed_ns for s in player.statistics_history)
+
+    elapsed_ns = sum(samples_ns)
+
+    return {
+        "calls": len(samples_ns),
+        "latency": summarize_latencies(samples_ns, "us", "samples"),
+        "move_latency": summarize_latencies(move_latencies_ns, "us", "samples"),
+        "moves_per_game": moves / len(samples_ns) if samples_ns else None,
+        "games_per_second": len(samples_ns) / elapsed_ns * 1e9 if elapsed_ns else None
+    }
+
+
+def run_benchmark(benchmark: str, positions: list, repeats: int, calls_per_sample: int, game_brain: str) -> dict:
+    if benchmark in (MINIMAX_BENCHMARK, ALPHA_BETA_BENCHMARK):
+        return benchmark_search(benchmark, positions, repeats)
+    elif benchmark == GET_WINNER_BENCHMARK:
+        return benchmark_calls(TicTacToeGameUtil.get_winner, [b for b, _ in positions], repeats, calls_per_sample)
+    elif benchmark == SERIALIZE_BENCHMARK:
+        return benchmark_calls(TicTacToeBoard.serialize, [b for b, _ in positions], repeats, calls_per_sample)
+    elif benchmark == DESERIALIZE_BENCHMARK:
+        board = TicTacToeBoard()
+        return benchmark_calls(board.deserialize, [b.serialize() for b, _ in positions], repeats, calls_per_sample)
+
+    return benchmark_games(game_brain, positions, repeats)
+
+
+def run_benchmarks(benchmarks: tuple = BENCHMARKS,
+                   suites: tuple = SUITES,
+                   repeats: int = DEFAULT_REPEATS,
+                   calls_per_sample: int = DEFAULT_CALLS_PER_SAMPLE,
+                   game_brain: str = ALPHA_BETA_BENCHMARK,
+                   warmup_repeats: int = DEFAULT_WARMUP_REPEATS) -> dict:
+    """
+    Runs every benchmark over every suite
+    :param repeats: how many times each position of a suite is measured
+    :param calls_per_sample: how many calls each sample of get_winner, serialize and deserialize averages
+    :param game_brain: one of GAME_BRAINS, the brain both players use for the full games
+    :param warmup_repeats: how many untimed rounds run over each suite before it is measured
+    :return: a dict with the settings and the results of each benchmark and suite
+    """
+    position_suites = get_position_suites()
+    results = {}
+
+    for benchmark in benchmarks:
+        results[benchmark] = {}
+
+        for suite in suites:
+            positions = position_suites[suite]
+
+            if warmup_repeats > 0:
+                run_benchmark(benchmark, positions, warmup_repeats, calls_per_sample, game_brain)
+
+            results[benchmark][suite] = run_benchmark(benchmark, positions, repeats, calls_per_sample, game_brain)
+
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": {
+            "repeats": repeats,
+            "calls_per_sample": calls_per_sample,
+            "game_brain": game_brain,
+            "warmup_repeats": warmup_repeats
+        },
+        "results": results
+    }
+
+
+def compare_to_baseline(report: dict, baseline: dict, max_slowdown: float) -> list:
+    """
+    Compares the p50 latency of every benchmark and suite that is in both reports
+    :return: a list of dicts with the benchmark, suite, both p50 latencies, the relative change and whether it is a
+    regression
+    """
+    comparisons = []
+
+    for benchmark, suites in report["results"].items():
+        for suite, result in suites.items():
+            baseline_result = baseline.get("results", {}).get(benchmark, {}).get(suite)
+
+            if not baseline_result or not baseline_result["latency"]["p50_us"]:
+                continue
+
+            baseline_p50 = baseline_result["latency"]["p50_us"]
+            current_p50 = result["latency"]["p50_us"]
+            change = current_p50 / baseline_p50 - 1
+
+            comparisons.append({
+                "benchmark": benchmark,
+                "suite": suite,
+                "baseline_p50_us": baseline_p50,
+                "p50_us": current_p50,
+                "change": change,
+                "regression": change > max_slowdown
+            })
+
+    return comparisons
+
+
+def print_report(report: dict):
+    print(f"Python {report['python']} on {report['platform']}")
+
+    for benchmark, suites in report["results"].items():
+        for suite, result in suites.items():
+            latency = result["latency"]
+            percentiles = ", ".join(f"p{p} {latency[f'p{p}_us']:.2f} us" for p in LATENCY_PERCENTILES)
+            throughput = []
+
+            if "nodes_per_second" in result:
+                throughput.append(f"{result['nodes_per_second']:,.0f} nodes/s")
+            if "games_per_second" in result:
+                throughput.append(f"{result['games_per_second']:,.1f} games/s")
+            if "calls_per_second" in result:
+                throughput.append(f"{result['calls_per_second']:,.0f} calls/s")
+
+            print(f"{benchmark:<12} {suite:<8} {result['calls']:>8} calls, mean {latency['mean_us']:.2f} us, "
+                  f"{percentiles}, {', '.join(throughput)}")
+
+
+def print_comparisons(comparisons: list):
+    for c in comparisons:
+        flag = " REGRESSION" if c["regression"] else ""
+        print(f"{c['benchmark']:<12} {c['suite']:<8} p50 {c['baseline_p50_us']:.2f} us -> {c['p50_us']:.2f} us "
+              f"({c['change'] * 100:+.1f}%){flag}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measures the Tic Tac Toe engine over fixed sets of positions")
+    parser.add_argument("--benchmarks", nargs="+", choices=BENCHMARKS, default=BENCHMARKS)
+    parser.add_argument("--suites", nargs="+", choices=SUITES, default=SUITES)
+    parser.add_argument("--repeats", type=int, default=DEFAULT_REPEATS,
+                        help="how many times each position is measured")
+    parser.add_argument("--warmup-repeats", type=int, default=DEFAULT_WARMUP_REPEATS,
+                        help="untimed rounds over each suite before it is measured")
+    parser.add_argument("--calls-per-sample", type=int, default=DEFAULT_CALLS_PER_SAMPLE,
+                        help="calls averaged by every sample of the cheap benchmarks")
+    parser.add_argument("--game-brain", choices=GAME_BRAINS, default=ALPHA_BETA_BENCHMARK,
+                        help="the brain both players use in the full games")
+    parser.add_argument("--json", metavar="PATH", help="write the results as JSON to PATH, to use as a baseline later")
+    parser.add_argument("--baseline", metavar="PATH", help="compare the results against the JSON saved at PATH")
+    parser.add_argument("--max-slowdown", type=float, default=DEFAULT_MAX_SLOWDOWN,
+                        help="exit with an error if any p50 is this much slower than the baseline, 0.25 is 25%%")
+    args = parser.parse_args()
+
+    report = run_benchmarks(tuple(args.benchmarks), tuple(args.suites), args.repeats, args.calls_per_sample,
+                            args.game_brain, args.warmup_repeats)
+    print_report(report)
+
+    if args.json:
+        with open(args.json, "w") as report_file:
+            json.dump(report, report_file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            comparisons = compare_to_baseline(report, json.load(baseline_file), args.max_slowdown)
+
+        print(f"Compared to {args.baseline}:")
+        print_comparisons(comparisons)
+
+        regressions = [c for c in comparisons if c["regression"]]
+
+        if regressions:
+            print(f"{len(regressions)} benchmarks are more than {args.max_slowdown * 100:.0f}% slower than the "
+                  f"baseline!")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
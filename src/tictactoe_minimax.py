@@ -1,3 +1,17 @@
+import argparse
+import collections
+import json
+import math
+import mmap
+import multiprocessing
+import os
+import random
+import struct
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+
+
 # Game messages
 ILLEGAL_MOVE_MSG = "The move is illegal, please try again..."
 WINNER_MSG = "The winner is:"
@@ -25,11 +39,151 @@ class GameToken:
 
 TIC_TAC_TOE_TOKENS = [GameToken("X"), GameToken("O")]
 
+# How serialize and __str__ write a cell, by whether it has an X (1), an O (2) or neither. X wins if somehow it's both
+SERIALIZED_CELLS = ("", "X", "O", "X")
+PRINTED_CELLS = ("   ", " X ", " O ", " X ")
+
+
+class RowStrings(dict):
+    """
+    The text of a board row, keyed by the row's X bits with its O bits right above them. Each text is built the first
+    time it's needed, so boards with many columns don't pay for every combination up front
+    """
+
+    def __init__(self, columns: int, separator: str, cell_texts: tuple):
+        super().__init__()
+        self.columns = columns
+        self.separator = separator
+        self.cell_texts = cell_texts
+
+    def __missing__(self, key: int) -> str:
+        x_bits = key & ((1 << self.columns) - 1)
+        o_bits = key >> self.columns
+        text = self.separator.join(self.cell_texts[(x_bits >> y & 1) | (o_bits >> y & 1) << 1]
+                                   for y in range(self.columns))
+        self[key] = text
+        return text
+
+
+# The classic game, a 3x3 board where you need 3 in a row to win
+BOARD_SIZE = 3
+WINNING_LINE_LENGTH = 3
+
+# Used by the AI when the board is too big to be searched until the end and no other budget is given
+DEFAULT_TIME_BUDGET_IN_SECONDS = 2.0
+
+
+class BoardGeometry:
+    """
+    Everything that only depends on the size of the board and the length of the winning lines. The board is stored as
+    two bitboards, one per token, where the square at (x, y) is the bit x * columns + y
+    """
+
+    # Building the masks is not free, so every geometry is built once and shared by all the boards using it
+    _geometries = {}
+
+    def __init__(self, rows: int, columns: int, k: int):
+        if rows < 1 or columns < 1 or not 1 <= k <= max(rows, columns):
+            raise ValueError(f"Invalid board: {rows}x{columns} with {k} in a row")
+
+        self.rows = rows
+        self.columns = columns
+        self.k = k
+        self.number_of_cells = rows * columns
+        self.full_board_mask = (1 << self.number_of_cells) - 1
+
+        # A token wins when its bitboard has every bit of one of these masks set
+        self.winning_line_masks = self._build_winning_line_masks()
+
+        # The lines going through each cell, so we only need to check those after a move
+        self.winning_lines_by_cell = tuple(
+            tuple(line for line, mask in enumerate(self.winning_line_masks) if mask & (1 << cell))
+            for cell in range(self.number_of_cells)
+        )
+        self.winning_line_masks_by_cell = tuple(
+            tuple(self.winning_line_masks[line] for line in lines) for lines in self.winning_lines_by_cell
+        )
+
+        # Cells taking part in more lines are usually better moves, break ties by how close they are to the centre.
+        #  On a 3x3 board this is the centre, then the corners and then the edges
+        centre_x = (rows - 1) / 2
+        centre_y = (columns - 1) / 2
+        self.centre_first_cells = tuple(sorted(
+            range(self.number_of_cells),
+            key=lambda c: (-len(self.winning_line_masks_by_cell[c]),
+                           abs(c // columns - centre_x) + abs(c % columns - centre_y),
+                           c)
+        ))
+        self.centre_first_rank = tuple(self.centre_first_cells.index(c) for c in range(self.number_of_cells))
+
+        # Boards are written out a row at a time, so serialize and __str__ never have to look at single cells
+        self.row_shifts = tuple(range(0, self.number_of_cells, columns))
+        self.row_mask = (1 << columns) - 1
+        self.serialized_rows = RowStrings(columns, ",", SERIALIZED_CELLS)
+        self.printed_rows = RowStrings(columns, "|", PRINTED_CELLS)
+
+    @staticmethod
+    def get(rows: int = BOARD_SIZE, columns: int = BOARD_SIZE, k: int = WINNING_LINE_LENGTH) -> object:
+        key = (rows, columns, k)
+
+        if key not in BoardGeometry._geometries:
+            BoardGeometry._geometries[key] = BoardGeometry(rows, columns, k)
+
+        return BoardGeometry._geometries[key]
+
+    @property
+    def dimensions(self) -> tuple:
+        return self.rows, self.columns, self.k
+
+    def coordinates_to_cell(self, x: int, y: int) -> int:
+        return x * self.columns + y
+
+    def cell_to_coordinates(self, cell: int) -> tuple:
+        return divmod(cell, self.columns)
+
+    def _build_winning_line_masks(self) -> tuple:
+        masks = []
+
+        # Every run of k squares going right, down, down-right or down-left from each square
+        for x in range(self.rows):
+            for y in range(self.columns):
+                for step_x, step_y in ((0, 1), (1, 0), (1, 1), (1, -1)):
+                    end_x = x + step_x * (self.k - 1)
+                    end_y = y + step_y * (self.k - 1)
+
+                    if 0 <= end_x < self.rows and 0 <= end_y < self.columns:
+                        masks.append(sum(1 << self.coordinates_to_cell(x + step_x * i, y + step_y * i)
+                                         for i in range(self.k)))
+
+        # With k == 1 all directions give the same single square
+        return tuple(dict.fromkeys(masks))
+
+
+DEFAULT_GEOMETRY = BoardGeometry.get()
+
+# Shortcuts for the classic 3x3 board, which is the only one the opening book knows about
+NUMBER_OF_CELLS = DEFAULT_GEOMETRY.number_of_cells
+FULL_BOARD_MASK = DEFAULT_GEOMETRY.full_board_mask
+WINNING_LINE_MASKS = DEFAULT_GEOMETRY.winning_line_masks
+
+
+def default_time_budget(rows: int, columns: int, k: int, time_budget: float = None) -> float:
+    """
+    :return: time_budget if one was given. Otherwise None for the classic board, which can be searched until the end,
+    and DEFAULT_TIME_BUDGET_IN_SECONDS for anything bigger, which can't in a reasonable time
+    """
+    if time_budget is None and (rows, columns, k) != DEFAULT_GEOMETRY.dimensions:
+        return DEFAULT_TIME_BUDGET_IN_SECONDS
+
+    return time_budget
+
 
 class TicTacToeBoard:
 
-    def __init__(self):
-        self.current_state = [[]]
+    def __init__(self, rows: int = BOARD_SIZE, columns: int = BOARD_SIZE, k: int = WINNING_LINE_LENGTH):
+        self.geometry = BoardGeometry.get(rows, columns, k)
+        self.x_bits = 0
+        self.o_bits = 0
         self.init_board()
 
         for t in TIC_TAC_TOE_TOKENS:
@@ -41,19 +195,72 @@ class TicTacToeBoard:
         assert self.x is not None and self.o is not None
 
     def init_board(self):
-        # Initialize a 3x3 board with no tokens
-        self.current_state = [
-            [None, None, None] for _ in range(3)
-        ]
+        # Initialize a board with no tokens
+        self.x_bits = 0
+        self.o_bits = 0
 
-    def get_empty_spaces_coordinates(self) -> list:
-        empty_spaces = []  # What are we living for? ♫
+    @property
+    def current_state(self) -> tuple:
+        """
+        A rows x columns matrix with the GameToken at each square or None if it is empty. This is built from the
+        bitboards on every access, so it is made of tuples to make writes to it fail instead of being lost. Use
+        place_token or assign a whole new matrix to change the board
+        """
+        return tuple(tuple(self.get_token(x, y) for y in range(self.geometry.columns))
+                     for x in range(self.geometry.rows))
 
-        for x, row in enumerate(self.current_state):
+    @current_state.setter
+    def current_state(self, state: list):
+        self.init_board()
+
+        for x, row in enumerate(state):
             for y, game_token in enumerate(row):
-                if game_token is None:
-                    empty_spaces.append((x, y))
+                if game_token is not None:
+                    self.place_token(x, y, game_token)
+
+    def get_token(self, x: int, y: int) -> GameToken:
+        cell_bit = 1 << self.geometry.coordinates_to_cell(x, y)
+
+        if self.x_bits & cell_bit:
+            return self.x
+        if self.o_bits & cell_bit:
+            return self.o
+        return None
+
+    def place_token(self, x: int, y: int, game_token: GameToken):
+        self.make_move(self.geometry.coordinates_to_cell(x, y), game_token)
+
+    def make_move(self, cell: int, game_token: GameToken):
+        """
+        Puts game_token on cell in place, the search uses this together with unmake_move instead of copying boards
+        """
+        if game_token == self.x:
+            self.x_bits |= 1 << cell
+        else:
+            self.o_bits |= 1 << cell
+
+    def unmake_move(self, cell: int, game_token: GameToken):
+        if game_token == self.x:
+            self.x_bits &= ~(1 << cell)
+        else:
+            self.o_bits &= ~(1 << cell)
+
+    def get_token_bits(self, game_token: GameToken) -> int:
+        return self.x_bits if game_token == self.x else self.o_bits
+
+    def get_empty_bits(self) -> int:
+        return ~(self.x_bits | self.o_bits) & self.geometry.full_board_mask
+
+    def is_full(self) -> bool:
+        return (self.x_bits | self.o_bits) == self.geometry.full_board_mask
+
+    def get_empty_cells(self) -> list:
+        empty_bits = self.get_empty_bits()
+        return [cell for cell in range(self.geometry.number_of_cells) if empty_bits & (1 << cell)]
 
+    def get_empty_spaces_coordinates(self) -> list:
+        # What are we living for? ♫
+        empty_spaces = [self.geometry.cell_to_coordinates(cell) for cell in self.get_empty_cells()]
         return empty_spaces
 
     def __str__(self) -> str:
@@ -64,27 +271,28 @@ class TicTacToeBoard:
          X | O | O
         :return: a str representation of the current board
         """
-        representation = "\n".join(
-            "|".join(["{:^3}".format(str(val)) if val is not None
-                      else "{:3}".format("") for val in row]) for row in self.current_state)
-        return representation
+        return "\n".join(self.get_row_strings(self.geometry.printed_rows))
 
     def serialize(self) -> str:
-        return ",".join([",".join([str(c) if c is not None else "" for c in row]) for row in self.current_state])
+        return ",".join(self.get_row_strings(self.geometry.serialized_rows))
+
+    def get_row_strings(self, row_strings: RowStrings) -> list:
+        x_bits = self.x_bits
+        o_bits = self.o_bits
+        mask = self.geometry.row_mask
+        columns = self.geometry.columns
+
+        return [row_strings[(x_bits >> shift & mask) | (o_bits >> shift & mask) << columns]
+                for shift in self.geometry.row_shifts]
 
     def deserialize(self, serialized_board: str) -> object:
-        state = []
+        self.init_board()
 
-        i = 0
         serialized_tokens = [s.upper() for s in serialized_board.split(",")]
 
-        while i < 9:
-            row = [None if not e else
-                   self.x if e.upper() == str(self.x) else self.o for e in serialized_tokens[i: i + 3]]
-            state.append(row)
-            i += 3
-
-        self.current_state = state
+        for cell, e in enumerate(serialized_tokens[:self.geometry.number_of_cells]):
+            if e:
+                self.make_move(cell, self.x if e == str(self.x) else self.o)
 
         return self
 
@@ -109,13 +317,21 @@ class DummyUI:
 
 class TicTacToeGame:
 
-    def __init__(self, players: list):
-        self.board = TicTacToeBoard()
+    def __init__(self, players: list, rows: int = BOARD_SIZE, columns: int = BOARD_SIZE,
+                 k: int = WINNING_LINE_LENGTH):
+        self.board = TicTacToeBoard(rows, columns, k)
         self.players = players
         self.winner = None
         self.legal_tokens = None
         self.legal_tokens = TIC_TAC_TOE_TOKENS
 
+        # Incremental state, kept up to date by apply_move so checking for the end of the game doesn't need to look at
+        #  the whole board after every move
+        self.tokens_in_line = {}
+        self.empty_spaces = 0
+        self.winning_token = None
+        self.load_board_state()
+
     def play(self):  
 
         # This will contain the main game loop
@@ -136,8 +352,7 @@ class TicTacToeGame:
                     move = player.make_move(self.board)
 
                 # Apply the player's move to the board since we now know it was legal
-                move_x, move_y = move[MOVE]
-                self.board.current_state[move_x][move_y] = move[GAME_TOKEN]
+                self.apply_move(move)
 
                 is_game_over_yet = self.is_game_over()
 
@@ -169,23 +384,50 @@ class TicTacToeGame:
         Determines if the game is already over
 
         In general, a TicTacToe game is over if:
-        1. There is a line of the same game_token horizontally, vertically or diagonally
+        1. There is a line of k of the same game_token horizontally, vertically or diagonally
         2. There are no more spaces to use
         :return:
         """
-        # Check if we have a winner
-        winning_token = TicTacToeGameUtil.get_winner(self.board)
-
-        if winning_token:
-            self.winner = self.token_to_player(winning_token)
+        # Check if we have a winner, apply_move already found out when the line was completed
+        if self.winning_token:
+            self.winner = self.token_to_player(self.winning_token)
             return True
 
         # Check if there are no more places to put a game_token
-        for row in self.board.current_state:
-            for val in row:
-                if val is None:
-                    return False
-        return True
+        return self.empty_spaces == 0
+
+    def apply_move(self, move: dict):
+        """
+        Places the game_token of a move that is known to be legal and updates the counts of the lines going through it
+        :param move: a dict with the move and the game_token to be placed by player
+        """
+        move_x, move_y = move[MOVE]
+        game_token = move[GAME_TOKEN]
+        geometry = self.board.geometry
+
+        self.board.place_token(move_x, move_y, game_token)
+        self.empty_spaces -= 1
+
+        tokens_in_line = self.tokens_in_line[game_token]
+
+        for line in geometry.winning_lines_by_cell[geometry.coordinates_to_cell(move_x, move_y)]:
+            tokens_in_line[line] += 1
+
+            if tokens_in_line[line] == geometry.k and self.winning_token is None:
+                self.winning_token = game_token
+
+    def load_board_state(self):
+        """
+        Rebuilds the incremental state from scratch, this is only needed if the board was changed without apply_move
+        """
+        masks = self.board.geometry.winning_line_masks
+
+        for game_token in self.legal_tokens:
+            token_bits = self.board.get_token_bits(game_token)
+            self.tokens_in_line[game_token] = [bin(token_bits & mask).count("1") for mask in masks]
+
+        self.empty_spaces = bin(self.board.get_empty_bits()).count("1")
+        self.winning_token = TicTacToeGameUtil.get_winner(self.board)
 
     def finish_game(self):
         """
@@ -229,37 +471,24 @@ class TicTacToeGameUtil:
         :param move_y: an int with the y coordinate for the move
         :return: True if the move is valid, False otherwise.
         """
-        board_size = len(board.current_state)
-
         # Check if the move is within bounds
-        if not 0 <= move_x < board_size or not 0 <= move_y < board_size:
+        if not 0 <= move_x < board.geometry.rows or not 0 <= move_y < board.geometry.columns:
             return False
 
         # Check the space is not in use already
-        value_at_board = board.current_state[move_x][move_y]
-
-        if value_at_board is not None:
-            return False
-
-        return True
+        return bool(board.get_empty_bits() & (1 << board.geometry.coordinates_to_cell(move_x, move_y)))
 
     @staticmethod
     def get_winner(board: TicTacToeBoard) -> GameToken:
-        for x, row in enumerate(board.current_state):
-            for y, gt in enumerate(row):
-
-                # There will be no winner combination on this row/column
-                if gt is None:
-                    continue
-
-                if TicTacToeGameUtil.check_complete_line_in_board(board, gt, x, y):
-                    winner_token = gt
-                    return winner_token
+        for game_token, token_bits in ((board.x, board.x_bits), (board.o, board.o_bits)):
+            for mask in board.geometry.winning_line_masks:
+                if token_bits & mask == mask:
+                    return game_token
 
     @staticmethod
     def check_complete_line_in_board(board: TicTacToeBoard, game_token: GameToken, x: int, y: int) -> bool:
         """
-        Checks if there are exactly three tokens equal to val horizontally, vertically and diagonally on the board
+        Checks if there are k tokens equal to val in a row horizontally, vertically and diagonally on the board
         respective to x and y
         :param board: the Board in which to check the line
         :param game_token: a str representing the game_token to look for
@@ -267,85 +496,437 @@ class TicTacToeGameUtil:
         :param y: an int representing the original Y coordinate of val
         :return: True if a line of successive val was found, False if otherwise
         """
-        num_of_same_tokens = 0
-        len_of_board = len(board.current_state)
+        token_bits = board.get_token_bits(game_token)
 
-        # Check horizontally
-        for j in range(len_of_board):
-            if board.current_state[x][j] == game_token:
-                num_of_same_tokens += 1
-            else:
-                break
+        # Only the lines going through (x, y) can be completed by it
+        for mask in board.geometry.winning_line_masks_by_cell[board.geometry.coordinates_to_cell(x, y)]:
+            if token_bits & mask == mask:
+                return True
 
-        if num_of_same_tokens == 3:
-            return True
+        return False
 
-        num_of_same_tokens = 0
+    @staticmethod
+    def get_token_from_str(token_str: str) -> GameToken:
+        for gt in TIC_TAC_TOE_TOKENS:
+            if str(gt).lower() == token_str.lower():
+                return gt
 
-        # Check vertically
-        for i in range(len_of_board):
-            if board.current_state[i][y] == game_token:
-                num_of_same_tokens += 1
-            else:
-                break
 
-        if num_of_same_tokens == 3:
-            return True
+# Values returned by the search, always from the point of view of the AI
+WIN_VALUE = 1
+LOSS_VALUE = -1
+DRAW_VALUE = 0
 
-        num_of_same_tokens = 0
+# The opening book stores one record per position, indexed by the base 3 number made by its cells (0 for an empty
+#  square, 1 for the player that moved first and 2 for the other one). Positions are always stored as if the first
+#  player was the one to move when both players have the same number of tokens.
+OPENING_BOOK_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tictactoe_opening_book.bin")
+OPENING_BOOK_MAGIC = b"TTTBOOK1"
+OPENING_BOOK_HEADER_FORMAT = "<8sBI"
+OPENING_BOOK_HEADER_SIZE = struct.calcsize(OPENING_BOOK_HEADER_FORMAT)
+OPENING_BOOK_RECORD_FORMAT = "<H"
+OPENING_BOOK_RECORD_SIZE = struct.calcsize(OPENING_BOOK_RECORD_FORMAT)
+NUMBER_OF_POSITIONS = 3 ** NUMBER_OF_CELLS
 
-        # Check diagonally top to bottom, but only if we can do so
-        if (x, y) in ((0, 0), (1, 1), (2, 2), (2, 0), (0, 2)):
+# Each record packs the best moves as a mask of cells, the value for the player to move (shifted so it is never
+#  negative) and a flag telling if the position can be reached at all
+BEST_MOVES_MASK = FULL_BOARD_MASK
+RECORD_VALUE_SHIFT = NUMBER_OF_CELLS
+RECORD_VALUE_MASK = 0b11
+RECORD_REACHABLE_FLAG = 1 << 15
 
-            # Left to right:
-            for i in range(len_of_board):
-                if game_token != board.current_state[i][i]:
-                    break
-                else:
-                    num_of_same_tokens += 1
+# The base 3 digits contributed by every possible 9-bit bitboard, so the index is just two lookups
+BASE_3_BY_BITS = tuple(
+    sum(3 ** cell for cell in range(NUMBER_OF_CELLS) if bits & (1 << cell)) for bits in range(FULL_BOARD_MASK + 1)
+)
 
-            if num_of_same_tokens == 3:
-                return True
 
-            num_of_same_tokens = 0
+class TicTacToeOpeningBook:
+
+    def __init__(self, table, table_offset: int = 0):
+        """
+        :param table: a bytes-like object with the records, usually a read-only mmap of the book file
+        :param table_offset: where the first record starts inside table
+        """
+        self.table = table
+        self.table_offset = table_offset
+
+    @staticmethod
+    def position_index(first_player_bits: int, second_player_bits: int) -> int:
+        return BASE_3_BY_BITS[first_player_bits] + 2 * BASE_3_BY_BITS[second_player_bits]
+
+    @staticmethod
+    def load(path: str = OPENING_BOOK_PATH) -> object:
+        """
+        Memory-maps the book at path, records are only read from disk when they are looked up
+        :return: a TicTacToeOpeningBook, None if the file is missing or was not built for this board
+        """
+        try:
+            with open(path, "rb") as book_file:
+                table = mmap.mmap(book_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            # ValueError is what mmap raises for an empty file
+            return None
+
+        expected_size = OPENING_BOOK_HEADER_SIZE + NUMBER_OF_POSITIONS * OPENING_BOOK_RECORD_SIZE
+
+        if len(table) != expected_size or \
+                struct.unpack_from(OPENING_BOOK_HEADER_FORMAT, table) != (OPENING_BOOK_MAGIC, BOARD_SIZE,
+                                                                          NUMBER_OF_POSITIONS):
+            table.close()
+            return None
 
-            # Right to left
-            for k in range(len_of_board):
-                i = 0 + k
-                j = 2 - k
-                if game_token == board.current_state[i][j]:
-                    num_of_same_tokens += 1
+        return TicTacToeOpeningBook(table, OPENING_BOOK_HEADER_SIZE)
 
-            return num_of_same_tokens == 3
+    def close(self):
+        if isinstance(self.table, mmap.mmap):
+            self.table.close()
 
+    def lookup(self, board: TicTacToeBoard, game_token: GameToken) -> tuple:
+        """
+        Gets the solved value and best moves for game_token, who is about to move on board
+        :return: a tuple with the value for game_token and a mask of the best cells, None if the position is not
+        in the book or it is not game_token's turn
+        """
+        if board.geometry.dimensions != DEFAULT_GEOMETRY.dimensions:
+            return None
+
+        my_bits = board.get_token_bits(game_token)
+        opponent_bits = (board.x_bits | board.o_bits) & ~my_bits
+        my_count = bin(my_bits).count("1")
+        opponent_count = bin(opponent_bits).count("1")
+
+        if my_count == opponent_count:
+            index = TicTacToeOpeningBook.position_index(my_bits, opponent_bits)
+        elif my_count + 1 == opponent_count:
+            index = TicTacToeOpeningBook.position_index(opponent_bits, my_bits)
         else:
-            return False
+            return None
+
+        record = struct.unpack_from(OPENING_BOOK_RECORD_FORMAT, self.table,
+                                    self.table_offset + index * OPENING_BOOK_RECORD_SIZE)[0]
+
+        if not record & RECORD_REACHABLE_FLAG:
+            return None
+
+        value = ((record >> RECORD_VALUE_SHIFT) & RECORD_VALUE_MASK) - 1
+        return value, record & BEST_MOVES_MASK
 
     @staticmethod
-    def get_token_from_str(token_str: str) -> GameToken:
-        for gt in TIC_TAC_TOE_TOKENS:
-            if str(gt).lower() == token_str.lower():
-                return gt
+    def solve() -> bytearray:
+        """
+        Walks every position that can be reached from the empty board and solves it
+        :return: a bytearray with one record per position index, unreachable positions are left as 0
+        """
+        table = bytearray(NUMBER_OF_POSITIONS * OPENING_BOOK_RECORD_SIZE)
+        solved = {}
 
+        def negamax(to_move_bits: int, waiting_bits: int) -> int:
+            # The value is always for the player about to move, which is why the children are negated
+            if bin(to_move_bits).count("1") == bin(waiting_bits).count("1"):
+                first_player_bits, second_player_bits = to_move_bits, waiting_bits
+            else:
+                first_player_bits, second_player_bits = waiting_bits, to_move_bits
 
-import math
+            index = TicTacToeOpeningBook.position_index(first_player_bits, second_player_bits)
+
+            if index in solved:
+                return solved[index]
+
+            best_moves = 0
+
+            if any(waiting_bits & mask == mask for mask in WINNING_LINE_MASKS):
+                # The player that just moved won
+                value = LOSS_VALUE
+            elif to_move_bits | waiting_bits == FULL_BOARD_MASK:
+                value = DRAW_VALUE
+            else:
+                value = -math.inf
+                empty_bits = ~(to_move_bits | waiting_bits) & FULL_BOARD_MASK
+
+                for cell in range(NUMBER_OF_CELLS):
+                    if not empty_bits & (1 << cell):
+                        continue
+
+                    new_value = -negamax(waiting_bits, to_move_bits | (1 << cell))
+
+                    if new_value > value:
+                        value = new_value
+                        best_moves = 1 << cell
+                    elif new_value == value:
+                        best_moves |= 1 << cell
+
+            record = RECORD_REACHABLE_FLAG | ((value + 1) << RECORD_VALUE_SHIFT) | best_moves
+            struct.pack_into(OPENING_BOOK_RECORD_FORMAT, table, index * OPENING_BOOK_RECORD_SIZE, record)
+            solved[index] = value
+
+            return value
+
+        negamax(0, 0)
+
+        return table
+
+    @staticmethod
+    def build(path: str = OPENING_BOOK_PATH) -> int:
+        """
+        Solves every position and writes the book to path
+        :return: the number of reachable positions that were written
+        """
+        table = TicTacToeOpeningBook.solve()
+
+        with open(path, "wb") as book_file:
+            book_file.write(struct.pack(OPENING_BOOK_HEADER_FORMAT, OPENING_BOOK_MAGIC, BOARD_SIZE,
+                                        NUMBER_OF_POSITIONS))
+            book_file.write(table)
+
+        return sum(1 for i in range(NUMBER_OF_POSITIONS)
+                   if struct.unpack_from(OPENING_BOOK_RECORD_FORMAT, table, i * OPENING_BOOK_RECORD_SIZE)[0])
+
+
+# Move ordering strategies available for the alpha-beta search
+CENTRE_CORNERS_EDGES_ORDERING = "centre_corners_edges"
+KILLER_ORDERING = "killer"
+HISTORY_ORDERING = "history"
+MOVE_ORDERINGS = (None, CENTRE_CORNERS_EDGES_ORDERING, KILLER_ORDERING, HISTORY_ORDERING)
+
+# How many killer moves we remember per ply
+KILLER_MOVES_PER_PLY = 2
+
+
+class SearchTimeoutError(Exception):
+    """
+    Raised from inside the search when the time budget for the move runs out
+    """
+    pass
+
+
+class SearchStatistics:
+    """
+    How much work a brain did to choose a single move
+    """
+
+    def __init__(self):
+        self.nodes_visited = 0
+
+        # The deepest ply the search reached, 0 being the board it was given
+        self.max_depth = 0
+
+        # Boards where the game was over (terminal) or that were scored by evaluate at the depth limit (heuristic)
+        self.terminal_evaluations = 0
+        self.heuristic_evaluations = 0
+
+        # Alpha-beta cutoffs, the number of times the rest of a node's moves were skipped
+        self.cutoffs = 0
+
+        self.completed_depth = None
+        self.rollouts = 0
+        self.used_opening_book = False
+        self.elapsed_ns = 0
+
+    def to_dict(self) -> dict:
+        return {
+            "nodes_visited": self.nodes_visited,
+            "max_depth": self.max_depth,
+            "terminal_evaluations": self.terminal_evaluations,
+            "heuristic_evaluations": self.heuristic_evaluations,
+            "cutoffs": self.cutoffs,
+            "completed_depth": self.completed_depth,
+            "rollouts": self.rollouts,
+            "used_opening_book": self.used_opening_book,
+            "elapsed_ns": self.elapsed_ns,
+            "nodes_per_second": self.nodes_visited / self.elapsed_ns * 1e9 if self.elapsed_ns else None
+        }
 
 
 class TicTacToeBrain:
 
+    def __init__(self, use_alpha_beta: bool = False, move_ordering: str = None, opening_book_path: str = None,
+                 max_depth: int = None, time_budget: float = None):
+        """
+        :param use_alpha_beta: True to search with alpha-beta pruning instead of plain minimax
+        :param move_ordering: one of MOVE_ORDERINGS, only used by the alpha-beta search
+        :param opening_book_path: a book built by TicTacToeOpeningBook.build, it is loaded on the first move. If it
+        can't be used the brain searches as usual
+        :param max_depth: the deepest the iterative deepening search will go, in moves
+        :param time_budget: the seconds the iterative deepening search has for each move. Setting this or max_depth
+        makes the brain use iterative deepening instead of searching until the end of the game
+        """
+        if move_ordering not in MOVE_ORDERINGS:
+            raise ValueError(f"Unknown move ordering: {move_ordering}")
+
+        if max_depth is not None and max_depth < 1:
+            raise ValueError(f"The search needs to be at least 1 move deep, got: {max_depth}")
+
+        self.use_alpha_beta = use_alpha_beta
+        self.move_ordering = move_ordering
+        self.max_depth = max_depth
+        self.time_budget = time_budget
+
+        # The iterative deepening search reports the depth of the last search it completed and its value
+        self.completed_depth = 0
+        self.search_value = None
+
+        # Set while an iterative deepening search is running
+        self.deadline = None
+        self.principal_cell = None
+
+        # The work done by the last call to calculate_next_move
+        self.statistics = SearchStatistics()
+
+        # Heuristic tables for the killer and history orderings, they are rebuilt on every calculate_next_move
+        self.killer_moves = {}
+        self.history_scores = {}
+
+        self.opening_book_path = opening_book_path
+        self.opening_book = None
+        self.has_tried_loading_book = False
+
     def calculate_next_move(self, board: TicTacToeBoard, game_token: GameToken) -> tuple:
         opponent_token = [t for t in TIC_TAC_TOE_TOKENS if t is not game_token][0]
-        minimax_result = self.minimax(board, game_token, opponent_token, is_ais_turn=True)
-        move = minimax_result[1]
-        return move
+
+        start_time = time.perf_counter_ns()
+        self.statistics = SearchStatistics()
+        self.killer_moves = {}
+        self.history_scores = {}
+
+        try:
+            book_move = self.get_book_move(board, game_token)
+
+            if book_move is not None:
+                self.statistics.used_opening_book = True
+                return book_move
+
+            if self.max_depth is not None or self.time_budget is not None:
+                search_result = self.iterative_deepening(board, game_token, opponent_token)
+                self.statistics.completed_depth = self.completed_depth
+            elif self.use_alpha_beta:
+                # Values never go outside of [LOSS_VALUE, WIN_VALUE] so this window still gives us the exact value
+                search_result = self.alpha_beta(board, game_token, opponent_token, is_ais_turn=True,
+                                                alpha=LOSS_VALUE, beta=WIN_VALUE)
+            else:
+                search_result = self.minimax(board, game_token, opponent_token, is_ais_turn=True)
+
+            move = search_result[1]
+            return move
+
+        finally:
+            self.statistics.elapsed_ns = time.perf_counter_ns() - start_time
+
+    def iterative_deepening(self, board: TicTacToeBoard,
+                            my_game_token: GameToken,
+                            opponent_game_token: GameToken) -> tuple:
+        """
+        Runs the alpha-beta search one move deeper each time, until max_depth is reached, the game is solved or the
+        time budget runs out. The move from the deepest search that was completed is the one that gets played
+        :return: a tuple with the value and the move of the last completed depth
+        """
+        empty_cells = board.get_empty_cells()
+
+        if not empty_cells or TicTacToeGameUtil.get_winner(board):
+            return self.alpha_beta(board, my_game_token, opponent_game_token, is_ais_turn=True,
+                                   alpha=LOSS_VALUE, beta=WIN_VALUE)
+
+        max_depth = len(empty_cells) if self.max_depth is None else min(self.max_depth, len(empty_cells))
+
+        # If not even the first depth can be completed in time, at least play the move that looks best on paper
+        fallback_cell = board.geometry.centre_first_cells[
+            min(board.geometry.centre_first_rank[c] for c in empty_cells)]
+        search_result = None, board.geometry.cell_to_coordinates(fallback_cell)
+
+        self.completed_depth = 0
+        self.search_value = None
+        self.principal_cell = None
+        self.deadline = None if self.time_budget is None else time.perf_counter() + self.time_budget
+
+        # A timeout leaves the moves of the interrupted search on the board, so we'll need to put it back as it was
+        original_bits = board.x_bits, board.o_bits
+
+        try:
+            for depth in range(1, max_depth + 1):
+                search_result = self.alpha_beta(board, my_game_token, opponent_game_token, is_ais_turn=True,
+                                                alpha=LOSS_VALUE, beta=WIN_VALUE, depth=depth)
+                self.completed_depth = depth
+                self.search_value = search_result[0]
+
+                # Search the best move of this depth first on the next one, that gives us the most cutoffs
+                self.principal_cell = board.geometry.coordinates_to_cell(*search_result[1])
+
+                if search_result[0] in (WIN_VALUE, LOSS_VALUE):
+                    # Only terminal boards score this much, searching deeper won't change the result
+                    break
+
+        except SearchTimeoutError:
+            board.x_bits, board.o_bits = original_bits
+
+        finally:
+            self.deadline = None
+            self.principal_cell = None
+
+        return search_result
+
+    def evaluate(self, board: TicTacToeBoard, my_game_token: GameToken, opponent_game_token: GameToken) -> float:
+        """
+        Scores a board where nobody has won yet for the cutoffs of the depth limited search. Every line that only one
+        of the players can still complete counts, and more so the more tokens it already has
+        :return: a float strictly between LOSS_VALUE and WIN_VALUE, so a real win or loss always counts more
+        """
+        my_bits = board.get_token_bits(my_game_token)
+        opponent_bits = board.get_token_bits(opponent_game_token)
+        k = board.geometry.k
+        score = 0
+
+        for mask in board.geometry.winning_line_masks:
+            my_tokens_in_line = my_bits & mask
+            opponent_tokens_in_line = opponent_bits & mask
+
+            if my_tokens_in_line and not opponent_tokens_in_line:
+                score += (bin(my_tokens_in_line).count("1") / k) ** 2
+            elif opponent_tokens_in_line and not my_tokens_in_line:
+                score -= (bin(opponent_tokens_in_line).count("1") / k) ** 2
+
+        # No line can have k tokens yet, so each of them adds less than 1
+        return score / len(board.geometry.winning_line_masks)
+
+    def get_book_move(self, board: TicTacToeBoard, game_token: GameToken) -> tuple:
+        """
+        Looks up the move in the opening book, loading it the first time it's needed
+        :return: the same move minimax would choose, None if there is no usable book entry
+        """
+        if self.opening_book_path is None:
+            return None
+
+        if not self.has_tried_loading_book:
+            self.opening_book = TicTacToeOpeningBook.load(self.opening_book_path)
+            self.has_tried_loading_book = True
+
+        if self.opening_book is None:
+            return None
+
+        book_entry = self.opening_book.lookup(board, game_token)
+
+        if book_entry is None or not book_entry[1]:
+            return None
+
+        # minimax keeps the first move with the best value, which is the lowest cell of the mask
+        best_moves = book_entry[1]
+        return board.geometry.cell_to_coordinates((best_moves & -best_moves).bit_length() - 1)
 
     def minimax(self, board: TicTacToeBoard,
                 my_game_token: GameToken,
                 opponent_game_token: GameToken,
-                is_ais_turn: bool) -> tuple:
+                is_ais_turn: bool,
+                ply: int = 0) -> tuple:
+        statistics = self.statistics
+        statistics.nodes_visited += 1
+
+        if ply > statistics.max_depth:
+            statistics.max_depth = ply
+
         winning_token = TicTacToeGameUtil.get_winner(board)
 
         if winning_token:
+            statistics.terminal_evaluations += 1
+
             if winning_token == my_game_token:
                 # The AI won
                 return 1, None
@@ -353,31 +934,29 @@ class TicTacToeBrain:
                 # The AI lost
                 return -1, None
 
-        possible_moves = board.get_empty_spaces_coordinates()
+        possible_moves = board.get_empty_cells()
 
         if not possible_moves and not winning_token:
             # This was a draw
+            statistics.terminal_evaluations += 1
             return 0, None
 
         if is_ais_turn:  # Maximize this player
             value = -math.inf
             chosen_move = None
 
-            for move in possible_moves:
-                # Make a new Board to keep the original intact
-                new_board_matrix = [row.copy() for row in board.current_state]
-                new_board = TicTacToeBoard()
-                new_board.current_state = new_board_matrix
-
-                # Make the move
-                new_board.current_state[move[0]][move[1]] = my_game_token
+            for cell in possible_moves:
+                # Make the move in place, it gets undone once we know its value
+                board.make_move(cell, my_game_token)
 
                 # Simulate the opponent making a move
-                new_value = self.minimax(new_board, my_game_token, opponent_game_token, is_ais_turn=False)[0]
+                new_value = self.minimax(board, my_game_token, opponent_game_token, is_ais_turn=False, ply=ply + 1)[0]
+
+                board.unmake_move(cell, my_game_token)
 
                 if new_value > value:
                     value = new_value
-                    chosen_move = move
+                    chosen_move = board.geometry.cell_to_coordinates(cell)
 
             return value, chosen_move
 
@@ -385,24 +964,443 @@ class TicTacToeBrain:
             value = math.inf
             chosen_move = None
 
-            for move in possible_moves:
-                # Make a new Board to keep the original intact
-                new_board_matrix = [row.copy() for row in board.current_state]
-                new_board = TicTacToeBoard()
-                new_board.current_state = new_board_matrix
-
-                # Make the move
-                new_board.current_state[move[0]][move[1]] = opponent_game_token
+            for cell in possible_moves:
+                # Make the move in place, it gets undone once we know its value
+                board.make_move(cell, opponent_game_token)
 
                 # Simulate the opponent making a move
-                new_value = self.minimax(new_board, my_game_token, opponent_game_token, is_ais_turn=True)[0]
+                new_value = self.minimax(board, my_game_token, opponent_game_token, is_ais_turn=True, ply=ply + 1)[0]
+
+                board.unmake_move(cell, opponent_game_token)
 
                 if new_value < value:
                     value = new_value
-                    chosen_move = move
+                    chosen_move = board.geometry.cell_to_coordinates(cell)
 
             return value, chosen_move
 
+    def alpha_beta(self, board: TicTacToeBoard,
+                   my_game_token: GameToken,
+                   opponent_game_token: GameToken,
+                   is_ais_turn: bool,
+                   alpha: float,
+                   beta: float,
+                   ply: int = 0,
+                   depth: int = None,
+                   last_cell: int = None) -> tuple:
+        """
+        Same search as minimax, but stops looking at the remaining moves of a node as soon as we know that the other
+        player will never let the game get there. The value for the root is the same one minimax would give us.
+        :param alpha: the value the AI is already guaranteed to get
+        :param beta: the value the opponent is already guaranteed to get
+        :param ply: how many moves deep into the search we are, used by the killer ordering
+        :param depth: how many more moves to search before using evaluate, None to search until the game ends
+        :param last_cell: the cell of the move that led to this board, None to look at the whole board for a winner
+        :return: a tuple with the value of the board and the chosen move
+        """
+        statistics = self.statistics
+        statistics.nodes_visited += 1
+
+        if ply > statistics.max_depth:
+            statistics.max_depth = ply
+
+        if self.deadline is not None and time.perf_counter() > self.deadline:
+            raise SearchTimeoutError()
+
+        if last_cell is None:
+            winning_token = TicTacToeGameUtil.get_winner(board)
+        else:
+            # The parent board had no winner, so only a line through the last move can have been completed
+            last_token = opponent_game_token if is_ais_turn else my_game_token
+            last_token_bits = board.get_token_bits(last_token)
+            winning_token = None
+
+            for mask in board.geometry.winning_line_masks_by_cell[last_cell]:
+                if last_token_bits & mask == mask:
+                    winning_token = last_token
+                    break
+
+        if winning_token:
+            statistics.terminal_evaluations += 1
+            return (WIN_VALUE, None) if winning_token == my_game_token else (LOSS_VALUE, None)
+
+        if board.is_full():
+            statistics.terminal_evaluations += 1
+            return DRAW_VALUE, None
+
+        # Most nodes of a depth limited search are these, they don't need their moves at all
+        if depth == 0:
+            statistics.heuristic_evaluations += 1
+            return self.evaluate(board, my_game_token, opponent_game_token), None
+
+        possible_moves = self.order_moves(board, board.get_empty_cells(), ply)
+        value = -math.inf if is_ais_turn else math.inf
+        chosen_cell = None
+        moving_token = my_game_token if is_ais_turn else opponent_game_token
+
+        for cell in possible_moves:
+            # Make the move in place, it gets undone once we know its value
+            board.make_move(cell, moving_token)
+            new_value = self.alpha_beta(board, my_game_token, opponent_game_token, not is_ais_turn,
+                                        alpha, beta, ply + 1, None if depth is None else depth - 1, cell)[0]
+            board.unmake_move(cell, moving_token)
+
+            if is_ais_turn:  # Maximize this player
+                if new_value > value:
+                    value = new_value
+                    chosen_cell = cell
+                alpha = max(alpha, value)
+
+            else:  # It's the opponents turn, minimize it!
+                if new_value < value:
+                    value = new_value
+                    chosen_cell = cell
+                beta = min(beta, value)
+
+            if alpha >= beta:
+                # The other player already has something better elsewhere, there is no point in looking any further
+                statistics.cutoffs += 1
+                self.record_cutoff(cell, ply, len(possible_moves))
+                break
+
+        return value, board.geometry.cell_to_coordinates(chosen_cell)
+
+    def order_moves(self, board: TicTacToeBoard, possible_moves: list, ply: int) -> list:
+        """
+        Sorts the moves so that the ones most likely to produce a cutoff are searched first
+        :param board: the Board the moves are for
+        :param possible_moves: a list with the empty cells
+        :param ply: how many moves deep into the search we are
+        :return: a new list with the same moves in the order they should be searched
+        """
+        if self.move_ordering == CENTRE_CORNERS_EDGES_ORDERING:
+            possible_moves = sorted(possible_moves, key=board.geometry.centre_first_rank.__getitem__)
+
+        elif self.move_ordering == KILLER_ORDERING:
+            killers = [k for k in self.killer_moves.get(ply, []) if k in possible_moves]
+            possible_moves = killers + [m for m in possible_moves if m not in killers]
+
+        elif self.move_ordering == HISTORY_ORDERING:
+            # sorted is stable, so moves with the same score keep the board order
+            possible_moves = sorted(possible_moves, key=lambda m: -self.history_scores.get(m, 0))
+
+        if ply == 0 and self.principal_cell in possible_moves:
+            # The best move of the previous iterative deepening search goes first
+            possible_moves = [self.principal_cell] + [m for m in possible_moves if m != self.principal_cell]
+
+        return possible_moves
+
+    def record_cutoff(self, move: int, ply: int, remaining_depth: int):
+        """
+        Remembers a move that caused a cutoff so that the killer and history orderings can try it first next time
+        """
+        if self.move_ordering == KILLER_ORDERING:
+            killers = self.killer_moves.setdefault(ply, [])
+            if move not in killers:
+                killers.insert(0, move)
+                del killers[KILLER_MOVES_PER_PLY:]
+
+        elif self.move_ordering == HISTORY_ORDERING:
+            # Cutoffs close to the root prune bigger subtrees, so they weigh more
+            self.history_scores[move] = self.history_scores.get(move, 0) + remaining_depth * remaining_depth
+
+
+# Monte Carlo tree search settings
+MINIMAX_BRAIN = "minimax"
+MCTS_BRAIN = "mcts"
+BRAINS = (MINIMAX_BRAIN, MCTS_BRAIN)
+DEFAULT_MCTS_ITERATIONS = 5000
+UCT_EXPLORATION = math.sqrt(2)
+
+# How many iterations to run between checks of the clock
+MCTS_ITERATIONS_BETWEEN_TIME_CHECKS = 64
+
+
+class MonteCarloTreeNode:
+    """
+    A position in the search tree. It's always stored from the point of view of the player about to move (mover) and
+    the one that just moved (waiting), so the tree doesn't care about which token is which
+    """
+
+    __slots__ = ("mover_bits", "waiting_bits", "move", "parent", "children", "untried_moves", "visits", "wins",
+                 "result")
+
+    def __init__(self, mover_bits: int, waiting_bits: int, geometry: BoardGeometry, move: int = None,
+                 parent: object = None):
+        self.mover_bits = mover_bits
+        self.waiting_bits = waiting_bits
+        self.move = move
+        self.parent = parent
+        self.children = []
+        self.visits = 0
+
+        # Rollouts won by the player that made self.move, draws count as half a win
+        self.wins = 0.0
+
+        # Only positions where the game is over have a result, also from the point of view of the player that just moved
+        self.result = None
+        occupied_bits = mover_bits | waiting_bits
+
+        # Only the lines through the last move can have been completed by it, the root has to check all of them
+        line_masks = geometry.winning_line_masks if move is None else geometry.winning_line_masks_by_cell[move]
+
+        if any(waiting_bits & mask == mask for mask in line_masks):
+            self.result = 1.0
+        elif occupied_bits == geometry.full_board_mask:
+            self.result = 0.5
+
+        self.untried_moves = [] if self.result is not None else \
+            [cell for cell in range(geometry.number_of_cells) if not occupied_bits & (1 << cell)]
+
+    def expand(self, cell: int, geometry: BoardGeometry) -> object:
+        # After the move the players switch places
+        child = MonteCarloTreeNode(self.waiting_bits, self.mover_bits | (1 << cell), geometry, cell, self)
+        self.children.append(child)
+        return child
+
+    def select_child(self, exploration: float) -> object:
+        log_visits = math.log(self.visits)
+        return max(self.children, key=lambda c: c.wins / c.visits + exploration * math.sqrt(log_visits / c.visits))
+
+    def find_descendant(self, mover_bits: int, waiting_bits: int, max_depth: int) -> object:
+        """
+        :return: the node for the given position among this node and its descendants up to max_depth moves away,
+        None if it hasn't been expanded
+        """
+        if self.mover_bits == mover_bits and self.waiting_bits == waiting_bits:
+            return self
+
+        if max_depth == 0:
+            return None
+
+        for child in self.children:
+            descendant = child.find_descendant(mover_bits, waiting_bits, max_depth - 1)
+
+            if descendant is not None:
+                return descendant
+
+        return None
+
+
+def rollout(node: MonteCarloTreeNode, geometry: BoardGeometry, rng: random.Random) -> float:
+    """
+    Plays random moves from node until the game ends
+    :return: 1 if the player that made node.move wins, 0.5 for a draw and 0 if it loses
+    """
+    if node.result is not None:
+        return node.result
+
+    empty_cells = node.untried_moves.copy()
+    rng.shuffle(empty_cells)
+
+    # Index 0 is the player about to move, which is the opponent of the player we are returning the result for
+    players_bits = [node.mover_bits, node.waiting_bits]
+    turn = 0
+
+    for cell in empty_cells:
+        players_bits[turn] |= 1 << cell
+
+        for mask in geometry.winning_line_masks_by_cell[cell]:
+            if players_bits[turn] & mask == mask:
+                return 0.0 if turn == 0 else 1.0
+
+        turn ^= 1
+
+    return 0.5
+
+
+def run_monte_carlo_tree_search(root: MonteCarloTreeNode, geometry: BoardGeometry, iterations: int, deadline: float,
+                                rng: random.Random, exploration: float = UCT_EXPLORATION,
+                                statistics: SearchStatistics = None) -> int:
+    """
+    Grows the tree under root with UCT until it runs out of iterations or time
+    :param iterations: the most rollouts to run, None to only stop at the deadline
+    :param deadline: the time.perf_counter() at which to stop, None to only stop after the iterations. At least one
+    rollout is always run
+    :param statistics: where to add the nodes the search went through, how deep it got and how many of the rollouts
+    started from a finished game
+    :return: the number of rollouts that were run
+    """
+    rollouts = 0
+    nodes_visited = 0
+    max_depth = 0
+    terminal_evaluations = 0
+
+    while iterations is None or rollouts < iterations:
+        # The clock isn't checked before the first rollout, so the root always gets at least one child to choose from
+        if deadline is not None and rollouts and rollouts % MCTS_ITERATIONS_BETWEEN_TIME_CHECKS == 0 and \
+                time.perf_counter() > deadline:
+            break
+
+        node = root
+        depth = 0
+
+        # Selection, go down the tree until we find a node that isn't fully expanded
+        while not node.untried_moves and node.children:
+            node = node.select_child(exploration)
+            depth += 1
+
+        # Expansion
+        if node.untried_moves:
+            node = node.expand(node.untried_moves.pop(rng.randrange(len(node.untried_moves))), geometry)
+            depth += 1
+
+        if node.result is not None:
+            terminal_evaluations += 1
+
+        nodes_visited += depth + 1
+
+        if depth > max_depth:
+            max_depth = depth
+
+        # Simulation
+        reward = rollout(node, geometry, rng)
+        rollouts += 1
+
+        # Backpropagation, what is good for one player is bad for the other
+        while node is not None:
+            node.visits += 1
+            node.wins += reward
+            reward = 1.0 - reward
+            node = node.parent
+
+    if statistics is not None:
+        statistics.nodes_visited += nodes_visited
+        statistics.max_depth = max(statistics.max_depth, max_depth)
+        statistics.terminal_evaluations += terminal_evaluations
+
+    return rollouts
+
+
+def _monte_carlo_tree_search_in_worker(rows: int, columns: int, k: int, mover_bits: int, waiting_bits: int,
+                                       iterations: int, time_budget: float, seed: int, exploration: float) -> tuple:
+    """
+    Runs an independent search on a worker process for root parallelization
+    :return: a tuple with a dict of the visits and wins of every root move, and the SearchStatistics of the search
+    """
+    geometry = BoardGeometry.get(rows, columns, k)
+    root = MonteCarloTreeNode(mover_bits, waiting_bits, geometry)
+    deadline = None if time_budget is None else time.perf_counter() + time_budget
+    statistics = SearchStatistics()
+    statistics.rollouts = run_monte_carlo_tree_search(root, geometry, iterations, deadline, random.Random(seed),
+                                                      exploration, statistics)
+
+    return {c.move: (c.visits, c.wins) for c in root.children}, statistics
+
+
+class MonteCarloTreeSearchBrain:
+
+    def __init__(self, iterations: int = DEFAULT_MCTS_ITERATIONS, time_budget: float = None, workers: int = 0,
+                 exploration: float = UCT_EXPLORATION, seed: int = None):
+        """
+        :param iterations: the rollouts each process runs per move, None to only use the time budget
+        :param time_budget: the seconds each move can take, None to only use the iterations
+        :param workers: how many extra processes run their own search from the same position, their results are
+        added to the ones of this process (root parallelization). 0 to search only on this process
+        :param exploration: the UCT exploration constant
+        :param seed: a seed for the random rollouts, to make the games repeatable
+        """
+        if iterations is None and time_budget is None:
+            raise ValueError("The search needs a number of iterations, a time budget or both")
+
+        if iterations is not None and iterations < 1:
+            raise ValueError(f"The search needs at least 1 iteration, got: {iterations}")
+
+        self.iterations = iterations
+        self.time_budget = time_budget
+        self.workers = workers
+        self.exploration = exploration
+        self.random = random.Random(seed)
+        self.executor = None
+
+        # The tree is kept between moves, so the part under the move that was actually played can be searched further
+        self.root = None
+        self.root_geometry = None
+
+        # What the last call to calculate_next_move did
+        self.rollouts = 0
+        self.reused_visits = 0
+        self.rollouts_per_second = 0.0
+        self.statistics = SearchStatistics()
+
+    def calculate_next_move(self, board: TicTacToeBoard, game_token: GameToken) -> tuple:
+        geometry = board.geometry
+        mover_bits = board.get_token_bits(game_token)
+        waiting_bits = (board.x_bits | board.o_bits) & ~mover_bits
+
+        start_time = time.perf_counter()
+        start_time_ns = time.perf_counter_ns()
+        deadline = None if self.time_budget is None else start_time + self.time_budget
+
+        self.statistics = SearchStatistics()
+        self.root = self.get_root(geometry, mover_bits, waiting_bits)
+        self.root_geometry = geometry
+        self.reused_visits = self.root.visits
+
+        if self.root.result is not None:
+            # The game is already over, there is nothing to play
+            self.statistics.elapsed_ns = time.perf_counter_ns() - start_time_ns
+            return None
+
+        # Start the other processes first so they search while this one does
+        futures = []
+
+        if self.workers:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                    mp_context=multiprocessing.get_context("spawn"))
+
+            futures = [self.executor.submit(_monte_carlo_tree_search_in_worker, *geometry.dimensions, mover_bits,
+                                            waiting_bits, self.iterations, self.time_budget,
+                                            self.random.randrange(2 ** 32), self.exploration)
+                       for _ in range(self.workers)]
+
+        self.rollouts = run_monte_carlo_tree_search(self.root, geometry, self.iterations, deadline, self.random,
+                                                    self.exploration, self.statistics)
+
+        visits_by_move = {c.move: c.visits for c in self.root.children}
+
+        for future in futures:
+            worker_results, worker_statistics = future.result()
+            self.rollouts += worker_statistics.rollouts
+
+            # The statistics cover the work of every process, like the rollouts do
+            self.statistics.nodes_visited += worker_statistics.nodes_visited
+            self.statistics.max_depth = max(self.statistics.max_depth, worker_statistics.max_depth)
+            self.statistics.terminal_evaluations += worker_statistics.terminal_evaluations
+
+            for cell, (visits, _) in worker_results.items():
+                visits_by_move[cell] = visits_by_move.get(cell, 0) + visits
+
+        elapsed_time = time.perf_counter() - start_time
+        self.rollouts_per_second = self.rollouts / elapsed_time if elapsed_time else 0.0
+        self.statistics.rollouts = self.rollouts
+        self.statistics.elapsed_ns = time.perf_counter_ns() - start_time_ns
+
+        # The most visited move is the most robust choice, its value estimate is the one backed by the most rollouts
+        best_cell = max(visits_by_move, key=visits_by_move.get)
+        return geometry.cell_to_coordinates(best_cell)
+
+    def get_root(self, geometry: BoardGeometry, mover_bits: int, waiting_bits: int) -> MonteCarloTreeNode:
+        """
+        Finds the current position in the tree of the last move, it should be two moves (ours and the opponent's)
+        under the old root. Builds a new tree if it's not there
+        """
+        if self.root is not None and self.root_geometry is geometry:
+            node = self.root.find_descendant(mover_bits, waiting_bits, max_depth=2)
+
+            if node is not None:
+                # Let the rest of the old tree go
+                node.parent = None
+                return node
+
+        return MonteCarloTreeNode(mover_bits, waiting_bits, geometry)
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
 
 class HumanPlayer:
 
@@ -412,26 +1410,48 @@ class HumanPlayer:
         self.game_token = game_token
 
     def make_move(self, board: TicTacToeBoard) -> dict:
-        move = self.ui.input(ENTER_YOUR_MOVE_MSG).split(",")
+        move = HumanPlayer.parse_move(self.ui.input(ENTER_YOUR_MOVE_MSG))
 
-        while not move or len(move) != 2 or not all([m.isdigit() for m in move]):
+        while move is None:
             self.ui.output(INVALID_FORMAT_FOR_MOVE_MSG)
-            move = self.ui.input(ENTER_YOUR_MOVE_MSG).split(",")
-
-        move = (int(move[0]), int(move[1]))
+            move = HumanPlayer.parse_move(self.ui.input(ENTER_YOUR_MOVE_MSG))
 
         return {
             GAME_TOKEN: self.game_token,
             MOVE: move
         }
 
+    @staticmethod
+    def parse_move(raw_move: str) -> tuple:
+        """
+        :param raw_move: a str with the comma-separated move as entered by the player
+        :return: a tuple with the x and y coordinates of the move, None if raw_move doesn't have the right format
+        """
+        move = raw_move.split(",") if raw_move else []
+
+        # isdigit would also let through characters like "²" that int can't parse
+        if len(move) != 2 or not all([m.isdecimal() for m in move]):
+            return None
+
+        return int(move[0]), int(move[1])
+
     def __str__(self):
         return self.name
 
 
+# Percentiles reported for the time it takes to choose a move
+LATENCY_PERCENTILES = (50, 90, 99)
+
+# How many nanoseconds make each of the units the latencies can be summarized in
+LATENCY_UNITS = {"ns": 1, "us": 1e3, "ms": 1e6, "s": 1e9}
+
+# How many of their latest moves the AI players keep the search statistics of
+STATISTICS_HISTORY = 1000
+
+
 class AIPlayer:
 
-    def __init__(self, brain: TicTacToeBrain, game_token: GameToken):
+    def __init__(self, brain: TicTacToeBrain, game_token: GameToken, history_size: int = STATISTICS_HISTORY):
         # An AI doesn't require a UI, so let's use a DummyUI so that the Game can broadcast messages to players but skip
         #  messaging the AIPlayers
         self.name = "AI_1"
@@ -439,9 +1459,67 @@ class AIPlayer:
         self.game_token = game_token
         self.brain = brain
 
+        # The SearchStatistics of the latest moves, the oldest ones are dropped once there are history_size of them
+        self.statistics_history = collections.deque(maxlen=history_size)
+
     def make_move(self, board: TicTacToeBoard) -> dict:
         move = self.brain.calculate_next_move(board, self.game_token)
 
+        # The brain starts a new SearchStatistics on every call, so keeping this one around is safe
+        self.statistics_history.append(self.brain.statistics)
+
+        return {
+            GAME_TOKEN: self.game_token,
+            MOVE: move
+        }
+
+    def get_statistics(self) -> dict:
+        """
+        Sums up the search statistics of the moves in the history
+        :return: a dict with the move latency percentiles, the totals of the work done and the statistics of every move
+        """
+        history = list(self.statistics_history)
+        nodes_visited = sum(s.nodes_visited for s in history)
+        elapsed_ns = sum(s.elapsed_ns for s in history)
+
+        return {
+            "player": self.name,
+            "game_token": str(self.game_token),
+            "latency": summarize_latencies([s.elapsed_ns for s in history]),
+            "nodes_visited": nodes_visited,
+            "nodes_per_second": nodes_visited / elapsed_ns * 1e9 if elapsed_ns else None,
+            "max_depth": max((s.max_depth for s in history), default=0),
+            "terminal_evaluations": sum(s.terminal_evaluations for s in history),
+            "heuristic_evaluations": sum(s.heuristic_evaluations for s in history),
+            "cutoffs": sum(s.cutoffs for s in history),
+            "rollouts": sum(s.rollouts for s in history),
+            "book_moves": sum(1 for s in history if s.used_opening_book),
+            "history": [s.to_dict() for s in history]
+        }
+
+    def export_statistics(self, path: str):
+        """
+        Writes get_statistics to path as JSON
+        """
+        with open(path, "w") as statistics_file:
+            json.dump(self.get_statistics(), statistics_file, indent=2)
+
+    def __str__(self):
+        return self.name
+
+
+class RandomPlayer:
+
+    def __init__(self, game_token: GameToken, seed: int = None):
+        # Like the AIPlayer, this is meant to play against other programs so it doesn't need a UI
+        self.name = "Random_1"
+        self.ui = DummyUI()
+        self.game_token = game_token
+        self.random = random.Random(seed)
+
+    def make_move(self, board: TicTacToeBoard) -> dict:
+        move = self.random.choice(board.get_empty_spaces_coordinates())
+
         return {
             GAME_TOKEN: self.game_token,
             MOVE: move
@@ -451,13 +1529,62 @@ class AIPlayer:
         return self.name
 
 
-def build_game() -> TicTacToeGame:
+def percentile(sorted_values: list, p: float) -> float:
+    """
+    Nearest-rank percentile of an already sorted list
+    :return: the value at percentile p, None if there are no values
+    """
+    if not sorted_values:
+        return None
+
+    rank = max(1, math.ceil(p / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarize_latencies(latencies_ns: list, unit: str = "ms", count_key: str = "moves") -> dict:
+    """
+    :param latencies_ns: the time each move took in nanoseconds, in any order
+    :param unit: one of LATENCY_UNITS, the unit of the summary, which is also the suffix of its keys
+    :param count_key: the key the number of latencies is stored under
+    :return: a dict with the number of latencies and their mean, min, max and LATENCY_PERCENTILES in unit
+    """
+    latencies_ns = sorted(latencies_ns)
+    divisor = LATENCY_UNITS[unit]
+
+    summary = {
+        count_key: len(latencies_ns),
+        f"mean_{unit}": sum(latencies_ns) / len(latencies_ns) / divisor if latencies_ns else None,
+        f"min_{unit}": latencies_ns[0] / divisor if latencies_ns else None,
+        f"max_{unit}": latencies_ns[-1] / divisor if latencies_ns else None
+    }
+
+    for p in LATENCY_PERCENTILES:
+        value = percentile(latencies_ns, p)
+        summary[f"p{p}_{unit}"] = value / divisor if value is not None else None
+
+    return summary
+
+
+def build_game(rows: int = BOARD_SIZE, columns: int = BOARD_SIZE, k: int = WINNING_LINE_LENGTH,
+               time_budget: float = None, brain: str = MINIMAX_BRAIN, mcts_workers: int = 0) -> TicTacToeGame:
     players = []
     ui = ConsoleUI()
 
     # Get the appropriate tokens
     tokens = TIC_TAC_TOE_TOKENS.copy()
-    ai_brain = TicTacToeBrain()
+
+    time_budget = default_time_budget(rows, columns, k, time_budget)
+
+    if brain not in BRAINS:
+        raise ValueError(f"Unknown brain: {brain}")
+
+    if brain == MCTS_BRAIN:
+        ai_brain = MonteCarloTreeSearchBrain(time_budget=time_budget, workers=mcts_workers)
+    else:
+        ai_brain = TicTacToeBrain(use_alpha_beta=time_budget is not None,
+                                  move_ordering=CENTRE_CORNERS_EDGES_ORDERING if time_budget is not None else None,
+                                  opening_book_path=OPENING_BOOK_PATH,
+                                  time_budget=time_budget)
 
     # Build the player instances
     player_tok = tokens.pop(0)
@@ -465,13 +1592,31 @@ def build_game() -> TicTacToeGame:
     player_tok = tokens.pop(0)
     players.append(AIPlayer(ai_brain, player_tok))
 
-    return TicTacToeGame(players)
+    return TicTacToeGame(players, rows, columns, k)
 
 
 def main():
-    game = build_game()
+    parser = argparse.ArgumentParser(description="Play Tic Tac Toe, or any m,n,k game, against the AI")
+    parser.add_argument("--rows", type=int, default=BOARD_SIZE)
+    parser.add_argument("--columns", type=int, default=BOARD_SIZE)
+    parser.add_argument("-k", type=int, default=WINNING_LINE_LENGTH, help="how many tokens in a row win the game")
+    parser.add_argument("--time-budget", type=float, default=None,
+                        help="seconds the AI can think about each move, it searches until the end if not given")
+    parser.add_argument("--brain", choices=BRAINS, default=MINIMAX_BRAIN, help="how the AI chooses its moves")
+    parser.add_argument("--mcts-workers", type=int, default=0,
+                        help="extra processes the mcts brain searches on, their results are added to its own")
+    parser.add_argument("--statistics", metavar="PATH", help="write how much the AI searched for each move to PATH as "
+                                                             "JSON once the game is over")
+    args = parser.parse_args()
+
+    game = build_game(args.rows, args.columns, args.k, args.time_budget, args.brain, args.mcts_workers)
     game.play()
 
+    if args.statistics:
+        for player in game.players:
+            if isinstance(player, AIPlayer):
+                player.export_statistics(args.statistics)
+
 
 if __name__ == '__main__':
     main()
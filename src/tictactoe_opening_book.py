@@ -0,0 +1,68 @@
+import argparse
+import time
+
+from tictactoe_minimax import (OPENING_BOOK_PATH, TIC_TAC_TOE_TOKENS, TicTacToeBoard, TicTacToeBrain,
+                               TicTacToeGameUtil, TicTacToeOpeningBook)
+
+
+def get_positions_to_measure() -> list:
+    """
+    Every position after the first two moves where the game is still going, with the token of the player to move
+    """
+    positions = []
+    x_token, o_token = TIC_TAC_TOE_TOKENS
+    empty_board = TicTacToeBoard()
+
+    for first_move in empty_board.get_empty_spaces_coordinates():
+        for second_move in empty_board.get_empty_spaces_coordinates():
+            if second_move == first_move:
+                continue
+
+            board = TicTacToeBoard()
+            board.place_token(*first_move, x_token)
+            board.place_token(*second_move, o_token)
+
+            if not TicTacToeGameUtil.get_winner(board):
+                positions.append((board, x_token))
+
+    return positions
+
+
+def measure_moves(brain: TicTacToeBrain, positions: list) -> float:
+    """
+    :return: the average time in seconds it took brain to choose a move for each of positions
+    """
+    start_time = time.perf_counter()
+
+    for board, game_token in positions:
+        brain.calculate_next_move(board, game_token)
+
+    return (time.perf_counter() - start_time) / len(positions)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Builds the Tic Tac Toe opening book and measures it against a "
+                                                 "live minimax search")
+    parser.add_argument("--path", default=OPENING_BOOK_PATH, help="where to write the book")
+    args = parser.parse_args()
+
+    start_time = time.perf_counter()
+    reachable_positions = TicTacToeOpeningBook.build(args.path)
+    print(f"Solved {reachable_positions} positions in {time.perf_counter() - start_time:.4f} s")
+
+    start_time = time.perf_counter()
+    book = TicTacToeOpeningBook.load(args.path)
+    print(f"Book loaded in {(time.perf_counter() - start_time) * 1000:.4f} ms")
+    book.close()
+
+    positions = get_positions_to_measure()
+    book_latency = measure_moves(TicTacToeBrain(opening_book_path=args.path), positions)
+    live_latency = measure_moves(TicTacToeBrain(), positions)
+
+    print(f"Average move latency over {len(positions)} positions:")
+    print(f"  Opening book: {book_latency * 1000:.4f} ms")
+    print(f"  Live minimax: {live_latency * 1000:.4f} ms")
+
+
+if __name__ == '__main__':
+    main()
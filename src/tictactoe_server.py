@@ -0,0 +1,372 @@
+import argparse
+import asyncio
+import collections
+import json
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+
+from concurrent.futures import ProcessPoolExecutor
+
+from tictactoe_minimax import (BOARD_SIZE, CENTRE_CORNERS_EDGES_ORDERING, ENTER_YOUR_MOVE_MSG, GAME_TOKEN,
+                               ILLEGAL_MOVE_MSG, INVALID_FORMAT_FOR_MOVE_MSG, MOVE, OPENING_BOOK_PATH,
+                               TIC_TAC_TOE_TOKENS, TICTACTOE_DRAW_MSG, TICTACTOE_ENDING_MSG, WINNER_MSG,
+                               WINNING_LINE_LENGTH, HumanPlayer, TicTacToeBoard, TicTacToeBrain, TicTacToeGame,
+                               TicTacToeGameUtil, default_time_budget, summarize_latencies)
+
+# The protocol is line based so any client, even netcat, can play. Once connected the client sends PLAY to start a
+#  game against the AI or STATS to get the server statistics as JSON. After that, every line the server sends starts
+#  with MSG when it's just for the player to read, or with ASK when the server is waiting for the player to answer
+#  with a line of its own.
+PLAY_COMMAND = "PLAY"
+STATS_COMMAND = "STATS"
+MESSAGE_PREFIX = "MSG"
+ASK_PREFIX = "ASK"
+
+WELCOME_MSG = f"Send {PLAY_COMMAND} to play against the AI or {STATS_COMMAND} for the server statistics"
+UNKNOWN_COMMAND_MSG = "Unknown command, bye!"
+SESSION_TIMED_OUT_MSG = "You have been idle for too long, bye!"
+LINE_TOO_LONG_MSG = "That line is too long, bye!"
+SESSION_FAILED_MSG = "Something went wrong on our side, bye!"
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+DEFAULT_IDLE_TIMEOUT_IN_SECONDS = 300.0
+
+# How many of the latest AI moves are kept to calculate the latency percentiles
+MOVE_LATENCY_HISTORY = 10000
+
+# Each worker process builds its own brain once, only the serialized boards travel between processes
+_worker_brain = None
+
+
+class SessionTimeoutError(Exception):
+    """
+    Raised when a player takes longer than the idle timeout to answer
+    """
+    pass
+
+
+class LineTooLongError(Exception):
+    """
+    Raised when a player sends a line longer than the stream's buffer limit
+    """
+    pass
+
+
+class AsyncSocketUI:
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, idle_timeout: float):
+        self.reader = reader
+        self.writer = writer
+        self.idle_timeout = idle_timeout
+
+    async def input(self, message: str) -> str:
+        self.writer.write(f"{ASK_PREFIX} {message}\n".encode())
+        await self.writer.drain()
+
+        try:
+            line = await asyncio.wait_for(self.reader.readline(), self.idle_timeout)
+        except asyncio.TimeoutError:
+            raise SessionTimeoutError()
+        except (asyncio.LimitOverrunError, ValueError):
+            # readline reports a line over the limit as a ValueError
+            raise LineTooLongError()
+
+        if not line:
+            raise ConnectionResetError("The client closed the connection")
+
+        # Whatever isn't valid UTF-8 can't be a move anyway, it will just be rejected like any other bad input
+        return line.decode(errors="replace").strip()
+
+    async def output(self, message: str):
+        # Boards span multiple lines, every one of them needs its own prefix
+        for line in str(message).split("\n"):
+            self.writer.write(f"{MESSAGE_PREFIX} {line}\n".encode())
+
+        await self.writer.drain()
+
+
+class AsyncDummyUI:
+
+    async def input(self, message: str) -> str:
+        pass
+
+    async def output(self, message: str):
+        pass
+
+
+class AsyncHumanPlayer:
+
+    def __init__(self, ui: AsyncSocketUI, game_token):
+        self.name = "Human_1"
+        self.ui = ui
+        self.game_token = game_token
+
+    async def make_move(self, board: TicTacToeBoard) -> dict:
+        move = HumanPlayer.parse_move(await self.ui.input(ENTER_YOUR_MOVE_MSG))
+
+        while move is None:
+            await self.ui.output(INVALID_FORMAT_FOR_MOVE_MSG)
+            move = HumanPlayer.parse_move(await self.ui.input(ENTER_YOUR_MOVE_MSG))
+
+        return {
+            GAME_TOKEN: self.game_token,
+            MOVE: move
+        }
+
+    def __str__(self):
+        return self.name
+
+
+class AsyncAIPlayer:
+
+    def __init__(self, server, game_token):
+        # The brain lives on the server's worker processes so that thinking doesn't stall the other sessions
+        self.name = "AI_1"
+        self.ui = AsyncDummyUI()
+        self.game_token = game_token
+        self.server = server
+
+    async def make_move(self, board: TicTacToeBoard) -> dict:
+        move = await self.server.calculate_next_move(board, self.game_token)
+
+        return {
+            GAME_TOKEN: self.game_token,
+            MOVE: move
+        }
+
+    def __str__(self):
+        return self.name
+
+
+class AsyncTicTacToeGame(TicTacToeGame):
+    """
+    The same game, but every player and UI call is awaited so many games can share the same process
+    """
+
+    async def play(self):
+
+        # This will contain the main game loop
+        is_game_over_yet = False
+
+        while not is_game_over_yet:
+
+            # Ask each of the players for their move
+            for player in self.players:
+
+                await player.ui.output(f"***** {player}'s turn! ******")
+                await player.ui.output(self.board)
+                move = await player.make_move(self.board)
+
+                # Check that the move is legal in the context of the board
+                while not self.is_valid_move(move):
+                    await player.ui.output(ILLEGAL_MOVE_MSG)
+                    move = await player.make_move(self.board)
+
+                # Apply the player's move to the board since we now know it was legal
+                self.apply_move(move)
+
+                is_game_over_yet = self.is_game_over()
+
+                # If the game has ended, break the player loop which in turn will break the game loop
+                if is_game_over_yet:
+                    break
+
+        await self.finish_game()
+
+    async def finish_game(self):
+        winner_result = TICTACTOE_DRAW_MSG if not self.winner else f"{WINNER_MSG} {self.winner}"
+        final_message = "\n".join([TICTACTOE_ENDING_MSG, str(self.board), winner_result])
+
+        for p in self.players:
+            await p.ui.output(final_message)
+
+
+class ServerStatistics:
+
+    def __init__(self):
+        self.started_at = time.time()
+        self.active_sessions = 0
+        self.active_games = 0
+        self.games_started = 0
+        self.games_finished = 0
+        self.sessions_timed_out = 0
+        self.sessions_failed = 0
+
+        # AI moves sent to the worker processes that haven't come back yet
+        self.pending_moves = 0
+        self.move_latencies_ns = collections.deque(maxlen=MOVE_LATENCY_HISTORY)
+
+    def to_dict(self) -> dict:
+        return {
+            "uptime_seconds": time.time() - self.started_at,
+            "active_sessions": self.active_sessions,
+            "active_games": self.active_games,
+            "games_started": self.games_started,
+            "games_finished": self.games_finished,
+            "sessions_timed_out": self.sessions_timed_out,
+            "sessions_failed": self.sessions_failed,
+            "pending_moves": self.pending_moves,
+            "move_latency": summarize_latencies(self.move_latencies_ns)
+        }
+
+
+def _init_worker(time_budget: float):
+    global _worker_brain
+    _worker_brain = TicTacToeBrain(use_alpha_beta=True,
+                                   move_ordering=CENTRE_CORNERS_EDGES_ORDERING,
+                                   opening_book_path=OPENING_BOOK_PATH,
+                                   time_budget=time_budget)
+
+
+def _calculate_next_move_in_worker(serialized_board: str, rows: int, columns: int, k: int, token_str: str) -> tuple:
+    board = TicTacToeBoard(rows, columns, k).deserialize(serialized_board)
+    return _worker_brain.calculate_next_move(board, TicTacToeGameUtil.get_token_from_str(token_str))
+
+
+class TicTacToeServer:
+
+    def __init__(self,
+                 rows: int = BOARD_SIZE,
+                 columns: int = BOARD_SIZE,
+                 k: int = WINNING_LINE_LENGTH,
+                 workers: int = None,
+                 idle_timeout: float = DEFAULT_IDLE_TIMEOUT_IN_SECONDS,
+                 time_budget: float = None):
+        time_budget = default_time_budget(rows, columns, k, time_budget)
+
+        self.rows = rows
+        self.columns = columns
+        self.k = k
+        self.idle_timeout = idle_timeout
+        self.statistics = ServerStatistics()
+
+        # Workers are started when they are first needed, a forked one would inherit the sockets of the sessions that
+        #  are open at the time and keep them from ever closing
+        self.executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                            initializer=_init_worker, initargs=(time_budget,))
+
+    async def calculate_next_move(self, board: TicTacToeBoard, game_token) -> tuple:
+        loop = asyncio.get_running_loop()
+        start_time = time.perf_counter_ns()
+        self.statistics.pending_moves += 1
+
+        try:
+            return await loop.run_in_executor(self.executor, _calculate_next_move_in_worker, board.serialize(),
+                                              self.rows, self.columns, self.k, str(game_token))
+        finally:
+            self.statistics.pending_moves -= 1
+            self.statistics.move_latencies_ns.append(time.perf_counter_ns() - start_time)
+
+    async def handle_session(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        ui = AsyncSocketUI(reader, writer, self.idle_timeout)
+        self.statistics.active_sessions += 1
+
+        try:
+            command = (await ui.input(WELCOME_MSG)).upper()
+
+            if command == STATS_COMMAND:
+                await ui.output(json.dumps(self.statistics.to_dict()))
+            elif command == PLAY_COMMAND:
+                await self.play_game(ui)
+            else:
+                await ui.output(UNKNOWN_COMMAND_MSG)
+
+        except SessionTimeoutError:
+            self.statistics.sessions_timed_out += 1
+            try:
+                await ui.output(SESSION_TIMED_OUT_MSG)
+            except ConnectionError:
+                pass
+
+        except LineTooLongError:
+            try:
+                await ui.output(LINE_TOO_LONG_MSG)
+            except ConnectionError:
+                pass
+
+        except ConnectionError:
+            # The client went away, there is no one left to tell
+            pass
+
+        except Exception:
+            # A bug in one session shouldn't take down the rest, log it and let this client go
+            self.statistics.sessions_failed += 1
+            print("Session failed:", file=sys.stderr)
+            traceback.print_exc()
+
+            try:
+                await ui.output(SESSION_FAILED_MSG)
+            except ConnectionError:
+                pass
+
+        finally:
+            self.statistics.active_sessions -= 1
+            writer.close()
+
+    async def play_game(self, ui: AsyncSocketUI):
+        human_token, ai_token = TIC_TAC_TOE_TOKENS
+        game = AsyncTicTacToeGame([AsyncHumanPlayer(ui, human_token), AsyncAIPlayer(self, ai_token)],
+                                  self.rows, self.columns, self.k)
+
+        self.statistics.games_started += 1
+        self.statistics.active_games += 1
+
+        try:
+            await game.play()
+            self.statistics.games_finished += 1
+        finally:
+            self.statistics.active_games -= 1
+
+    async def report_statistics(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            print(json.dumps(self.statistics.to_dict()), flush=True)
+
+    async def serve(self, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT, unix_path: str = None,
+                    stats_interval: float = None):
+        if unix_path:
+            server = await asyncio.start_unix_server(self.handle_session, path=unix_path)
+        else:
+            server = await asyncio.start_server(self.handle_session, host, port)
+
+        reporter = asyncio.ensure_future(self.report_statistics(stats_interval)) if stats_interval else None
+
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            if reporter:
+                reporter.cancel()
+            self.executor.shutdown(wait=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Hosts many Tic Tac Toe games against the AI at the same time")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--unix", metavar="PATH", help="listen on a unix socket at PATH instead of TCP")
+    parser.add_argument("--rows", type=int, default=BOARD_SIZE)
+    parser.add_argument("--columns", type=int, default=BOARD_SIZE)
+    parser.add_argument("-k", type=int, default=WINNING_LINE_LENGTH)
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="processes the AI thinks on")
+    parser.add_argument("--idle-timeout", type=float, default=DEFAULT_IDLE_TIMEOUT_IN_SECONDS,
+                        help="seconds a player can take to answer before the session is closed")
+    parser.add_argument("--time-budget", type=float, default=None, help="seconds the AI can think about each move")
+    parser.add_argument("--stats-interval", type=float, default=None,
+                        help="print the server statistics as JSON every this many seconds")
+    args = parser.parse_args()
+
+    server = TicTacToeServer(args.rows, args.columns, args.k, args.workers, args.idle_timeout, args.time_budget)
+
+    try:
+        asyncio.run(server.serve(args.host, args.port, args.unix, args.stats_interval))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()